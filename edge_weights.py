@@ -0,0 +1,92 @@
+import copy
+from typing import Tuple
+
+import numpy as np
+
+
+class EdgeWeights:
+    """
+    Match weights of the admissible (student, course) pairs only, as an edge
+    list sorted by student and then by course. Indexing with `[si, ci]` (scalars
+    or arrays) works like indexing a dense weight matrix in which the other
+    pairs are NaN, so memory scales with the number of admissible pairs.
+
+    The pairs are fixed when the weights are built; only their values change.
+    """
+
+    def __init__(self, students, courses, values, shape: Tuple[int, int]):
+        students = np.asarray(students, dtype=np.int64)
+        courses = np.asarray(courses, dtype=np.int64)
+        order = np.lexsort((courses, students))
+        self.students = students[order]
+        self.courses = courses[order]
+        self.values = np.asarray(values, dtype=np.float64)[order]
+        self.shape = shape
+        # edges of student si are [indptr[si], indptr[si + 1])
+        self.indptr = np.searchsorted(self.students, np.arange(shape[0] + 1))
+        self._keys = self.students * shape[1] + self.courses
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def find(self, students, courses) -> np.ndarray:
+        """ Edge index of each (student, course) pair, or -1 if it has none """
+        students = np.asarray(students, dtype=np.int64)
+        courses = np.asarray(courses, dtype=np.int64)
+        keys = students * self.shape[1] + courses
+        if len(self._keys) == 0:
+            return np.full(np.shape(keys), -1)
+        edges = np.minimum(
+            np.searchsorted(self._keys, keys), len(self._keys) - 1)
+        found = (courses >= 0) & (courses < self.shape[1]) & (
+                self._keys[edges] == keys)
+        return np.where(found, edges, -1)
+
+    def student_edges(self, si: int) -> slice:
+        return slice(self.indptr[si], self.indptr[si + 1])
+
+    def __getitem__(self, pair):
+        edges = self.find(*pair)
+        if len(self) == 0:
+            values = np.full(np.shape(edges), np.nan)
+        else:
+            values = np.where(edges >= 0, self.values[edges], np.nan)
+        return values[()] if np.ndim(values) == 0 else values
+
+    def __setitem__(self, pair, values):
+        """ Setting a pair that is not admissible only accepts NaN """
+        edges = self.find(*pair)
+        values = np.broadcast_to(np.asarray(values, dtype=np.float64),
+                                 np.shape(edges))
+        missing = edges < 0
+        if (missing & ~np.isnan(values)).any():
+            raise KeyError('Cannot set the weight of a pair that is not '
+                           'admissible')
+        self.values[edges[~missing]] = values[~missing]
+
+    def add(self, students, courses, values):
+        """
+        Adds `values` to the weights of the pairs, as many times as a pair
+        is listed. Pairs that are not admissible are skipped, as they stay NaN
+        """
+        edges = self.find(students, courses)
+        values = np.broadcast_to(np.asarray(values, dtype=np.float64),
+                                 np.shape(edges))
+        np.add.at(self.values, edges[edges >= 0], values[edges >= 0])
+
+    def with_values(self, values: np.ndarray) -> 'EdgeWeights':
+        """ The same pairs with new weights, one per edge """
+        weights = copy.copy(self)
+        weights.values = np.asarray(values, dtype=np.float64)
+        return weights
+
+    def copy(self) -> 'EdgeWeights':
+        return self.with_values(self.values.copy())
+
+    def __deepcopy__(self, memo) -> 'EdgeWeights':
+        return self.copy()
+
+    def to_dense(self, default_value: float = np.nan) -> np.ndarray:
+        dense = np.full(self.shape, default_value)
+        dense[self.students, self.courses] = self.values
+        return dense
@@ -0,0 +1,549 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+try:
+    from ortools.graph.python import min_cost_flow
+except ImportError:  # only the ortools solver needs it
+    min_cost_flow = None
+
+
+class OrToolsSolver:
+    """
+    Min cost flow of the whole graph with OR-Tools. OR-Tools cannot warm
+    start from a previous solution, so every solve loads the arrays of the
+    graph into a new solver with one bulk call.
+    """
+
+    def solve(self, graph) -> Optional[np.ndarray]:
+        if min_cost_flow is None:
+            raise ImportError('The ortools solver requires ortools >= 9.5')
+        flow = min_cost_flow.SimpleMinCostFlow()
+        # arcs without capacity are left out, as if they were never added
+        arcs = np.flatnonzero(graph.capacities > 0)
+        flow.add_arcs_with_capacity_and_unit_cost(
+            graph.tails[arcs], graph.heads[arcs], graph.capacities[arcs],
+            graph.costs[arcs])
+        for node in np.flatnonzero(graph.supplies):
+            flow.set_node_supply(int(node), int(graph.supplies[node]))
+        if flow.solve() != flow.OPTIMAL:
+            return None
+        flows = np.zeros(len(graph.tails), dtype=np.int64)
+        flows[arcs] = flow.flows(np.arange(len(arcs)))
+        return flows
+
+
+class SlotAssignment:
+    """
+    The graph as an assignment of the students without a fixed match (rows)
+    to the course slots left open by the fixed matches (columns). Every row
+    also has a column of its own for leaving the student unassigned.
+
+    Fixed students and filled slots take the first slots of their course,
+    which are the most valuable ones. When the source supplies fewer students
+    than there are open slots, blocker rows take the slots that have to stay
+    empty at no cost.
+    """
+
+    def __init__(self, graph):
+        num_students = graph.num_students
+        supplies = graph.supplies
+        self.feasible = True
+
+        students, courses, arcs = graph.match_arcs()
+        has_capacity = graph.capacities[arcs] > 0
+        students, courses, arcs = (
+            students[has_capacity], courses[has_capacity], arcs[has_capacity])
+        is_forced = supplies[:num_students] > 0
+        forced = is_forced[students]
+        self.forced_arcs = arcs[forced]
+        taken = np.bincount(
+            courses[forced], minlength=graph.num_courses) + supplies[
+            num_students:num_students + graph.num_courses]
+
+        self.slot_courses, self.slot_paths = graph.slot_paths()
+        slot_counts = np.bincount(
+            self.slot_courses, minlength=graph.num_courses)
+        self.slot_indices = np.arange(len(self.slot_courses)) - np.repeat(
+            np.cumsum(slot_counts) - slot_counts, slot_counts)
+        self.taken = taken
+        self.units = int(supplies[graph.source])
+        # every fixed student must keep the arc to its course
+        if forced.sum() != is_forced.sum() or (taken > slot_counts).any() or \
+                self.units < 0:
+            self.feasible = False
+            return
+
+        # columns [0, num_open) are the open slots, grouped by course
+        self.open_slots = np.flatnonzero(
+            self.slot_indices >= taken[self.slot_courses])
+        num_open = len(self.open_slots)
+        open_counts = np.bincount(
+            self.slot_courses[self.open_slots], minlength=graph.num_courses)
+        open_starts = np.cumsum(open_counts) - open_counts
+
+        self.students = np.flatnonzero(~is_forced)
+        num_free = len(self.students)
+        rows_of_students = np.full(num_students, -1)
+        rows_of_students[self.students] = np.arange(num_free)
+        students, courses, arcs = (
+            students[~forced], courses[~forced], arcs[~forced])
+        repeats = open_counts[courses]
+        entry_arcs = np.repeat(np.arange(len(arcs)), repeats)
+        cols = np.repeat(open_starts[courses], repeats) + np.arange(
+            repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        rows = rows_of_students[students[entry_arcs]]
+        self.match_arcs = arcs[entry_arcs]
+        self.entry_students = students[entry_arcs]
+        self.entry_slots = self.open_slots[cols]
+        costs = self.entry_costs(graph.costs)
+
+        # columns [num_open, num_open + num_free) leave a student unassigned
+        unassigned = np.arange(num_free)
+        num_blockers = max(0, num_open - self.units)
+        blockers = np.repeat(np.arange(num_blockers), num_open)
+        self.rows = np.concatenate(
+            [rows, unassigned, num_free + blockers]).astype(np.int64)
+        self.cols = np.concatenate(
+            [cols, num_open + unassigned,
+             np.tile(np.arange(num_open), num_blockers)]).astype(np.int64)
+        self.costs = np.concatenate(
+            [costs, np.zeros(num_free + len(blockers), dtype=np.int64)])
+        self.shape = (num_free + num_blockers, num_open + num_free)
+        self.num_arcs = len(graph.tails)
+
+    def key(self) -> Tuple:
+        """ Identifies the rows and columns of the assignment """
+        return (self.shape, self.students.tobytes(),
+                self.slot_courses[self.open_slots].tobytes())
+
+    def entry_costs(self, arc_costs: np.ndarray) -> np.ndarray:
+        """
+        Costs of the entries that assign a student to a slot, given the cost
+        of every arc of the graph (along the last axis of `arc_costs`)
+        """
+        slot_costs = arc_costs[..., self.slot_paths].sum(axis=-1)
+        return arc_costs[..., self.entry_students] + arc_costs[
+            ..., self.match_arcs] + slot_costs[..., self.entry_slots]
+
+    def dense_costs(self, square=False,
+                    entry_costs: np.ndarray = None) -> np.ndarray:
+        """
+        If `square`, adds a row per column the other rows leave over, which
+        takes either an open slot that stays empty or the unassigned column of
+        a student who is assigned, both at no cost. `entry_costs` (see
+        `entry_costs`) replace the costs of assigning students to slots, with
+        one cost matrix per leading index.
+        """
+        costs = self.costs
+        if entry_costs is not None:
+            batch = entry_costs.shape[:-1]
+            costs = np.concatenate([entry_costs, np.broadcast_to(
+                costs[len(self.match_arcs):],
+                batch + (len(costs) - len(self.match_arcs),))], axis=-1)
+        dense = np.full(costs.shape[:-1] + self.shape, np.inf)
+        dense[..., self.rows, self.cols] = costs
+        if square:
+            dense = np.concatenate([dense, np.zeros(
+                costs.shape[:-1] + (self.shape[1] - self.shape[0],
+                                    self.shape[1]))], axis=-2)
+        return dense
+
+    def arc_flows(self, assigned_cols: np.ndarray) -> np.ndarray:
+        """ Flow on every arc of the graph, given the column of each row """
+        num_free, num_open = len(self.students), len(self.open_slots)
+        flows = np.zeros(self.num_arcs, dtype=np.int64)
+        flows[self.forced_arcs] = 1
+        rows = np.flatnonzero(assigned_cols[:num_free] < num_open)
+        cols = assigned_cols[rows]
+        # the source -> student arc of student si is arc si
+        flows[self.students[rows]] = 1
+        entries = self.rows * self.shape[1] + self.cols
+        lookup = dict(zip(entries[:len(self.match_arcs)].tolist(),
+                          self.match_arcs.tolist()))
+        flows[[lookup[entry] for entry in
+               (rows * self.shape[1] + cols).tolist()]] = 1
+        # the students of a course fill its first slots
+        filled = self.taken + np.bincount(
+            self.slot_courses[self.open_slots[cols]],
+            minlength=len(self.taken))
+        flows[self.slot_paths[
+            self.slot_indices < filled[self.slot_courses]]] = 1
+        # the source -> sink arc is the last arc
+        flows[-1] = self.units - len(rows)
+        return flows
+
+
+class ScipySolver:
+    """
+    Solves the `SlotAssignment` with SciPy: `linear_sum_assignment` on the
+    dense cost matrix, or `min_weight_full_bipartite_matching` on the sparse
+    one when few students can fill each slot.
+    """
+
+    def __init__(self, max_dense_density=0.2):
+        self.max_dense_density = max_dense_density
+
+    def solve(self, graph) -> Optional[np.ndarray]:
+        problem = SlotAssignment(graph)
+        if not problem.feasible:
+            return None
+        density = len(problem.costs) / max(
+            1, problem.shape[0] * problem.shape[1])
+        try:
+            if density > self.max_dense_density:
+                rows, cols = linear_sum_assignment(problem.dense_costs())
+            else:
+                # weights must be non-zero, so every weight is shifted
+                shift = 1 - min(0, int(problem.costs.min(initial=0)))
+                rows, cols = min_weight_full_bipartite_matching(
+                    sp.csr_matrix(
+                        (problem.costs + shift, (problem.rows, problem.cols)),
+                        shape=problem.shape))
+        except ValueError:
+            return None
+        assigned_cols = np.empty(problem.shape[0], dtype=np.int64)
+        assigned_cols[rows] = cols
+        return problem.arc_flows(assigned_cols)
+
+
+class NumpySolver:
+    """
+    Solves the `SlotAssignment` with shortest augmenting paths
+    (Jonker-Volgenant) written in NumPy. The column prices of the last solve
+    are kept, so re-solving an assignment with the same rows and columns
+    after a few cost changes only reassigns the rows they affect.
+    """
+
+    def __init__(self):
+        self.warm_start = None
+
+    def solve(self, graph) -> Optional[np.ndarray]:
+        problem = SlotAssignment(graph)
+        if not problem.feasible:
+            return None
+        costs = problem.dense_costs()
+        if self.warm_start is not None and self.warm_start[0] == \
+                problem.key():
+            prices, assigned_cols = (
+                self.warm_start[1].copy(), self.warm_start[2].copy())
+        else:
+            # greedy start: each column goes to the first row it is cheapest for
+            prices = np.zeros(problem.shape[1])
+            cheapest = costs.argmin(axis=1)
+            first = np.zeros(len(cheapest), dtype=bool)
+            first[np.unique(cheapest, return_index=True)[1]] = True
+            assigned_cols = np.where(first, cheapest, -1)
+        row_prices = tighten(costs, prices, assigned_cols)
+        if not augment(costs, row_prices, prices, assigned_cols):
+            return None
+        self.warm_start = (problem.key(), prices, assigned_cols)
+        return problem.arc_flows(assigned_cols)
+
+
+class AuctionSolver:
+    """
+    Solves the square `SlotAssignment` with a Jacobi auction with epsilon
+    scaling. Costs are scaled by the number of rows plus one, so bidding down
+    to an epsilon of one gives an optimal assignment. The prices of the last
+    solve are kept, so re-solving an assignment with the same rows and columns
+    after its costs change starts from them with a small epsilon and takes
+    few bidding rounds.
+    """
+
+    def __init__(self, scaling=5, warm_epsilon=1 / 32):
+        self.scaling = scaling
+        self.warm_epsilon = warm_epsilon
+        self.warm_start = None
+
+    def solve(self, graph) -> Optional[np.ndarray]:
+        problem = SlotAssignment(graph)
+        if not problem.feasible:
+            return None
+        benefits = -problem.dense_costs(square=True) * (problem.shape[1] + 1)
+        finite = benefits[np.isfinite(benefits)]
+        spread = float(finite.max() - finite.min())
+        # epsilons stay whole numbers, so prices and bids are exact
+        epsilon = max(1.0, spread // self.scaling)
+        if self.warm_start is not None and self.warm_start[0] == \
+                problem.key():
+            prices, assigned_cols = (
+                self.warm_start[1].copy(), self.warm_start[2].copy())
+            epsilon = max(1.0, spread * self.warm_epsilon // 1)
+        else:
+            prices = np.zeros(problem.shape[1])
+            assigned_cols = np.full(len(benefits), -1)
+        while True:
+            auction(benefits, prices, epsilon, spread, assigned_cols)
+            if epsilon == 1.0:
+                break
+            epsilon = max(1.0, epsilon // self.scaling)
+        # only price differences matter, so keep the prices small
+        self.warm_start = (
+            problem.key(), prices - prices.min(), assigned_cols)
+        return problem.arc_flows(assigned_cols[:problem.shape[0]])
+
+
+def auction(benefits: np.ndarray, prices: np.ndarray, epsilon: float,
+            spread: float, assigned_cols: np.ndarray):
+    """
+    Assigns every row of the square `benefits` to a column by letting all
+    unassigned rows bid for their best column at once, raising `prices` and
+    updating `assigned_cols` in place. Rows already assigned within `epsilon`
+    of their best value keep their column, the others bid again. Every row
+    ends within `epsilon` of its best value.
+    """
+    rows = np.arange(len(benefits))
+    assigned = np.flatnonzero(assigned_cols >= 0)
+    values = benefits[assigned] - prices
+    keep = values[np.arange(len(assigned)), assigned_cols[assigned]] >= \
+        values.max(axis=1) - epsilon
+    assigned_cols[assigned[~keep]] = -1
+    owners = np.full(len(rows), -1)
+    owners[assigned_cols[assigned[keep]]] = assigned[keep]
+    while True:
+        bidders = np.flatnonzero(assigned_cols < 0)
+        if len(bidders) == 0:
+            return
+        values = benefits[bidders] - prices
+        best = values.argmax(axis=1)
+        best_values = values[np.arange(len(bidders)), best]
+        values[np.arange(len(bidders)), best] = -np.inf
+        # a row with a single column bids as if the next were `spread` worse
+        second_values = np.maximum(values.max(axis=1), best_values - spread)
+        bids = prices[best] + best_values - second_values + epsilon
+
+        # each column goes to its highest bidder
+        order = np.lexsort((-bids, best))
+        won = order[np.concatenate([[True], best[order][1:] !=
+                                    best[order][:-1]])]
+        cols = best[won]
+        outbid = owners[cols]
+        assigned_cols[outbid[outbid >= 0]] = -1
+        owners[cols] = bidders[won]
+        assigned_cols[bidders[won]] = cols
+        prices[cols] = bids[won]
+
+
+class BatchAssignmentSolver:
+    """
+    Solves many copies of the `SlotAssignment` of a graph that differ only in
+    their arc costs, such as noisy trials, all at once with shortest
+    augmenting paths (Jonker-Volgenant) vectorized over the copies. Every copy
+    starts from the optimal assignment and prices of the unchanged graph, so
+    only the rows that the changes make worse off are reassigned. Returns the
+    course of every student in every copy instead of arc flows.
+    """
+
+    def __init__(self, graph):
+        self.problem = SlotAssignment(graph)
+        self.num_students = graph.num_students
+        self.feasible = self.problem.feasible
+        if not self.feasible:
+            return
+        forced_arcs = self.problem.forced_arcs
+        self.forced_students = graph.tails[forced_arcs]
+        self.forced_courses = graph.heads[forced_arcs] - graph.num_students
+        costs = self.problem.dense_costs(square=True)[np.newaxis]
+        self.prices = np.zeros((1, costs.shape[2]))
+        self.assigned_cols = np.full((1, costs.shape[1]), -1)
+        row_prices = batch_tighten(costs, self.prices, self.assigned_cols)
+        self.feasible = bool(batch_augment(
+            costs, row_prices, self.prices, self.assigned_cols)[0])
+
+    def solve(self, arc_costs: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Course of every student (-1 if unassigned) for each row of
+        `arc_costs`, the costs of every arc of the graph in one copy. Returns
+        `None` if some copy has no assignment.
+        """
+        problem = self.problem
+        if not self.feasible:
+            return None
+        costs = problem.dense_costs(True, problem.entry_costs(arc_costs))
+        prices = np.repeat(self.prices, len(costs), axis=0)
+        assigned_cols = np.repeat(self.assigned_cols, len(costs), axis=0)
+        row_prices = batch_tighten(costs, prices, assigned_cols)
+        if not batch_augment(costs, row_prices, prices, assigned_cols).all():
+            return None
+
+        courses = np.full((len(costs), self.num_students), -1)
+        courses[:, self.forced_students] = self.forced_courses
+        num_free, num_open = len(problem.students), len(problem.open_slots)
+        cols = assigned_cols[:, :num_free]
+        copies, rows = np.nonzero(cols < num_open)
+        courses[copies, problem.students[rows]] = problem.slot_courses[
+            problem.open_slots[cols[copies, rows]]]
+        return courses
+
+
+def batch_tighten(costs: np.ndarray, prices: np.ndarray,
+                  assigned_cols: np.ndarray) -> np.ndarray:
+    """
+    `tighten` on a stack of square `costs`, with one row of `prices` and of
+    `assigned_cols` per copy. Every column of a square assignment ends up
+    assigned, so the column prices are kept.
+    """
+    row_prices = (costs - prices[:, np.newaxis, :]).min(axis=2)
+    copies, rows = np.nonzero(assigned_cols >= 0)
+    cols = assigned_cols[copies, rows]
+    loose = costs[copies, rows, cols] - prices[copies, cols] != row_prices[
+        copies, rows]
+    assigned_cols[copies[loose], rows[loose]] = -1
+    return row_prices
+
+
+def batch_augment(costs: np.ndarray, row_prices: np.ndarray,
+                  prices: np.ndarray, assigned_cols: np.ndarray) -> np.ndarray:
+    """
+    `augment` on a stack of square `costs`, with one row of prices and of
+    `assigned_cols` per copy: each round searches one shortest augmenting
+    path in every copy that still has an unassigned row, one column of every
+    copy per step. Returns which copies could be completely assigned.
+    """
+    copies, size = assigned_cols.shape
+    assigned_rows = np.full((copies, size), -1)
+    owned_by, rows = np.nonzero(assigned_cols >= 0)
+    assigned_rows[owned_by, assigned_cols[owned_by, rows]] = rows
+    feasible = np.ones(copies, dtype=bool)
+    while True:
+        unassigned = (assigned_cols < 0) & feasible[:, np.newaxis]
+        active = np.flatnonzero(unassigned.any(axis=1))
+        if len(active) == 0:
+            return feasible
+        starts = unassigned[active].argmax(axis=1)
+        shortest = np.full((len(active), size), np.inf)
+        path = np.full((len(active), size), -1)
+        visited = np.zeros((len(active), size), dtype=bool)
+        distances = np.zeros(len(active))
+        ends = np.full(len(active), -1)
+        rows = starts.copy()
+        searching = np.arange(len(active))
+        while len(searching):
+            copy = active[searching]
+            row = rows[searching]
+            reduced = distances[searching, np.newaxis] + costs[copy, row] - \
+                row_prices[copy, row][:, np.newaxis] - prices[copy]
+            shorter = ~visited[searching] & (reduced < shortest[searching])
+            found, cols = np.nonzero(shorter)
+            path[searching[found], cols] = row[found]
+            shortest[searching[found], cols] = reduced[found, cols]
+            candidates = np.where(
+                visited[searching], np.inf, shortest[searching])
+            distance = candidates.min(axis=1)
+            # among the closest columns, prefer one that is unassigned
+            closest = candidates == distance[:, np.newaxis]
+            free = closest & (assigned_rows[copy] < 0)
+            col = np.where(free.any(axis=1), free.argmax(axis=1),
+                           closest.argmax(axis=1))
+            stuck = distance == np.inf
+            feasible[copy[stuck]] = False
+            visited[searching, col] = True
+            distances[searching] = distance
+            owners = assigned_rows[copy, col]
+            ends[searching[(owners < 0) & ~stuck]] = col[(owners < 0) & ~stuck]
+            rows[searching] = owners
+            searching = searching[(owners >= 0) & ~stuck]
+
+        done = np.flatnonzero(ends >= 0)
+        copy = active[done]
+        deltas = np.where(visited[done], distances[done, np.newaxis] -
+                          shortest[done], 0.0)
+        row_prices[copy, starts[done]] += distances[done]
+        # the rows of the visited columns stay tight to them
+        through, cols = np.nonzero(
+            visited[done] & (assigned_rows[copy] >= 0))
+        row_prices[copy[through], assigned_rows[copy[through], cols]] += \
+            deltas[through, cols]
+        prices[copy] -= deltas
+
+        col = ends[done]
+        walking = np.arange(len(done))
+        while len(walking):
+            copy_walking = copy[walking]
+            row = path[done[walking], col]
+            previous = assigned_cols[copy_walking, row]
+            assigned_rows[copy_walking, col] = row
+            assigned_cols[copy_walking, row] = col
+            moving = row != starts[done[walking]]
+            walking = walking[moving]
+            col = previous[moving]
+
+
+def tighten(costs: np.ndarray, prices: np.ndarray,
+            assigned_cols: np.ndarray) -> np.ndarray:
+    """
+    Returns row prices that make the costs reduced by `prices` non-negative.
+    Unassigns every row whose column is not among its cheapest ones, and
+    resets the prices of unassigned columns to zero, as an optimal
+    assignment requires.
+    """
+    rows = np.arange(len(assigned_cols))
+    while True:
+        row_prices = (costs - prices).min(axis=1)
+        assigned = assigned_cols >= 0
+        tight = np.zeros(len(rows), dtype=bool)
+        tight[assigned] = costs[rows[assigned], assigned_cols[assigned]] - \
+            prices[assigned_cols[assigned]] == row_prices[assigned]
+        assigned_cols[~tight] = -1
+        unassigned = np.ones(len(prices), dtype=bool)
+        unassigned[assigned_cols[tight]] = False
+        if not prices[unassigned].any():
+            return row_prices
+        prices[unassigned] = 0
+
+
+def augment(costs: np.ndarray, row_prices: np.ndarray, prices: np.ndarray,
+            assigned_cols: np.ndarray) -> bool:
+    """
+    Assigns every unassigned row along a shortest augmenting path of reduced
+    costs, updating the prices in place. Returns False if some row cannot be
+    assigned.
+    """
+    assigned_rows = np.full(costs.shape[1], -1)
+    assigned = np.flatnonzero(assigned_cols >= 0)
+    assigned_rows[assigned_cols[assigned]] = assigned
+    for start in np.flatnonzero(assigned_cols < 0):
+        shortest = np.full(costs.shape[1], np.inf)
+        path = np.full(costs.shape[1], -1)
+        visited = np.zeros(costs.shape[1], dtype=bool)
+        visited_rows = []
+        row, distance = start, 0.0
+        while True:
+            reduced = distance + costs[row] - row_prices[row] - prices
+            shorter = ~visited & (reduced < shortest)
+            path[shorter] = row
+            shortest[shorter] = reduced[shorter]
+            candidates = np.where(visited, np.inf, shortest)
+            distance = candidates.min()
+            if distance == np.inf:
+                return False
+            # among the closest columns, prefer one that is unassigned
+            closest = np.flatnonzero(candidates == distance)
+            free = closest[assigned_rows[closest] < 0]
+            col = free[0] if len(free) else closest[0]
+            visited[col] = True
+            if assigned_rows[col] < 0:
+                break
+            row = assigned_rows[col]
+            visited_rows.append(row)
+
+        row_prices[start] += distance
+        visited_rows = np.array(visited_rows, dtype=int)
+        row_prices[visited_rows] += distance - shortest[
+            assigned_cols[visited_rows]]
+        prices[visited] -= distance - shortest[visited]
+        while True:
+            row = path[col]
+            assigned_rows[col] = row
+            assigned_cols[row], col = col, assigned_cols[row]
+            if row == start:
+                break
+    return True
+
+
+SOLVERS = {'ortools': OrToolsSolver, 'scipy': ScipySolver,
+           'numpy': NumpySolver, 'auction': AuctionSolver}
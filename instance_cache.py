@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Callable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import params
+from edge_weights import EdgeWeights
+from ranks import RankedFrame, Ranks
+
+# change when the compiled instance is built differently
+CACHE_VERSION = 2
+
+# student data, course data, match weights, fixed matches, previous matches
+Instance = Tuple[RankedFrame, RankedFrame, EdgeWeights, pd.DataFrame,
+                 pd.DataFrame]
+
+
+def instance_key(input_files: List[str]) -> str:
+    """
+    Hash of the contents of the input files, in order, and of the current
+    values of `params`. A missing file hashes differently from an empty one.
+    """
+    digest = hashlib.sha256(f'version {CACHE_VERSION}\n'.encode())
+    for filename in input_files:
+        if os.path.isfile(filename):
+            with open(filename, 'rb') as file:
+                content = file.read()
+            digest.update(f'file {len(content)}\n'.encode())
+            digest.update(content)
+        else:
+            digest.update(b'missing\n')
+    for param, param_val in sorted(vars(params).items()):
+        if not param.startswith('__'):
+            digest.update(f'{param}={param_val!r}\n'.encode())
+    return digest.hexdigest()
+
+
+def load_or_compile(cache_dir: str, input_files: List[str],
+                    compile_instance: Callable[[], Instance]) -> Instance:
+    """
+    Returns the instance compiled from `input_files` by `compile_instance`,
+    reading it from `cache_dir` if it was compiled before from the same inputs
+    and params, and writing it there otherwise
+    """
+    directory = os.path.join(cache_dir, instance_key(input_files))
+    if os.path.isfile(os.path.join(directory, 'instance.json')):
+        return load_instance(directory)
+    instance = compile_instance()
+    save_instance(directory, *instance)
+    return instance
+
+
+def save_instance(directory: str, student_data: RankedFrame,
+                  course_data: RankedFrame, weights: EdgeWeights,
+                  fixed_matches: pd.DataFrame, previous_matches: pd.DataFrame):
+    """
+    Writes the instance as one .npy file per array, plus a manifest, so every
+    array can be memory mapped when loaded
+    """
+    arrays = {}
+    manifest = {
+        'student_data': _frame_manifest(student_data, 'student_data', arrays),
+        'course_data': _frame_manifest(course_data, 'course_data', arrays),
+        'fixed_matches': _frame_manifest(
+            fixed_matches, 'fixed_matches', arrays),
+        'previous_matches': _frame_manifest(
+            previous_matches, 'previous_matches', arrays),
+        'weights_shape': list(weights.shape)}
+    for name, frame in (('student_data', student_data),
+                        ('course_data', course_data)):
+        ranks = frame.ranks
+        arrays[f'{name}.ranks.ids'] = _strings(ranks.ids)
+        arrays[f'{name}.ranks.rows'] = ranks.rows
+        arrays[f'{name}.ranks.others'] = ranks.others
+        arrays[f'{name}.ranks.codes'] = ranks.codes
+        arrays[f'{name}.ranks.places'] = ranks.places
+    arrays['weights.students'] = weights.students
+    arrays['weights.courses'] = weights.courses
+    arrays['weights.values'] = weights.values
+
+    # write to a temporary directory first, so a partly written instance is
+    # never read
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    partial = tempfile.mkdtemp(dir=os.path.dirname(directory))
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(partial, name + '.npy'), array,
+                    allow_pickle=False)
+        with open(os.path.join(partial, 'instance.json'), 'w') as f:
+            json.dump(manifest, f)
+        os.rename(partial, directory)
+    except OSError:
+        # another run cached the same instance first
+        shutil.rmtree(partial, ignore_errors=True)
+        if not os.path.isfile(os.path.join(directory, 'instance.json')):
+            raise
+
+
+def load_instance(directory: str) -> Instance:
+    with open(os.path.join(directory, 'instance.json')) as f:
+        manifest = json.load(f)
+
+    def array(name: str) -> np.ndarray:
+        return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+
+    frames = {}
+    for name in ('student_data', 'course_data'):
+        frame = RankedFrame(_load_frame(manifest[name], name, array))
+        frame.ranks = Ranks(
+            frame.index, pd.Index(array(f'{name}.ranks.ids').tolist(),
+                                  dtype=object),
+            np.array(array(f'{name}.ranks.rows')),
+            np.array(array(f'{name}.ranks.others')),
+            np.array(array(f'{name}.ranks.codes')),
+            np.array(array(f'{name}.ranks.places')))
+        frames[name] = frame
+    weights = EdgeWeights(
+        array('weights.students'), array('weights.courses'),
+        array('weights.values'), tuple(manifest['weights_shape']))
+    fixed_matches = _load_frame(
+        manifest['fixed_matches'], 'fixed_matches', array)
+    previous_matches = _load_frame(
+        manifest['previous_matches'], 'previous_matches', array)
+    return frames['student_data'], frames['course_data'], weights, \
+        fixed_matches, previous_matches
+
+
+def _strings(values) -> np.ndarray:
+    return np.array([str(value) for value in values], dtype=str)
+
+
+def _frame_manifest(frame: pd.DataFrame, name: str, arrays: dict) -> dict:
+    """
+    Adds the index and every column of `frame` to `arrays`, and returns how
+    to rebuild it. Object columns are stored as strings, with a mask of the
+    missing values.
+    """
+    manifest = {'columns': [], 'strings': []}
+    if not isinstance(frame.index, pd.RangeIndex):
+        arrays[f'{name}.index'] = _strings(frame.index)
+        manifest['index'] = True
+    for i, column in enumerate(frame.columns):
+        values = frame[column]
+        manifest['columns'].append(column)
+        manifest['strings'].append(values.dtype == object)
+        if values.dtype == object:
+            arrays[f'{name}.{i}'] = _strings(values.fillna(''))
+            arrays[f'{name}.{i}.missing'] = values.isna().to_numpy()
+        else:
+            arrays[f'{name}.{i}'] = values.to_numpy()
+    return manifest
+
+
+def _load_frame(manifest: dict, name: str,
+                array: Callable[[str], np.ndarray]) -> pd.DataFrame:
+    index = None
+    if manifest.get('index'):
+        index = pd.Index(array(f'{name}.index').tolist(), dtype=object)
+    columns = {}
+    for i, (column, strings) in enumerate(
+            zip(manifest['columns'], manifest['strings'])):
+        if strings:
+            values = np.array(array(f'{name}.{i}').tolist(), dtype=object)
+            values[array(f'{name}.{i}.missing')] = np.nan
+        else:
+            values = np.array(array(f'{name}.{i}'))
+        columns[column] = pd.Series(values, index=index, dtype=values.dtype)
+    if not columns:
+        return pd.DataFrame(columns=manifest['columns'], index=index)
+    return pd.DataFrame(columns, index=index, columns=manifest['columns'])
@@ -1,15 +1,92 @@
 import csv
 import math
+import statistics
 import sys
-from typing import List, Tuple, Dict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Dict, Optional
 
 import numpy as np
 import pandas as pd
+from scipy import interpolate, special
+from scipy.stats import qmc
 
+import flow_solvers
 import matching
 import min_cost_flow
+import residual_graph
+import trial_store
+from edge_weights import EdgeWeights
 
 BucketsType = List[Tuple[float, float, float, List[Tuple[np.ndarray, float]]]]
+# base weights, student weight data, course graph data and fixed matches
+TrialContext = Tuple[EdgeWeights, pd.DataFrame, pd.DataFrame, pd.DataFrame]
+
+# trials run by one task of the pool, each task with its own random stream; a
+# power of 2 keeps the balance of the Sobol' points of a task
+TRIALS_PER_TASK = 32
+# smallest chance of a match that is reported, see `parse_simulations_output`
+REPORT_THRESHOLD = 0.02
+# sigmas closer than the resolution of the costs cannot be told apart
+SIGMA_RESOLUTION = 10 ** -min_cost_flow.DIGITS
+# how the noise of the trials of a task is drawn, see `standard_noise`
+NOISE_MODES = ('iid', 'antithetic', 'sobol')
+# which pairs the trials may match, see `candidate_pairs`
+CANDIDATE_SETS = ('all', 'listed', 'area')
+
+# options of the simulations for the rest of the execution, see `configure`;
+# all but `STORE_IGNORED_OPTIONS` change the counts of the trials
+simulation_options = {'noise': 'iid', 'common_noise': False,
+                      'report_variance': False, 'screen_sigmas': None,
+                      'batched': False, 'speculative_sigmas': 1,
+                      'candidates': 'all'}
+STORE_IGNORED_OPTIONS = ('report_variance', 'speculative_sigmas')
+
+# trial graphs of a worker process
+_worker_state = None
+
+
+def configure(**options):
+    """
+    Sets the options of the interview simulations for the rest of the
+    execution. `noise` is one of `NOISE_MODES`; with `common_noise`, every
+    sigma scales the same standard normal draws; with `report_variance`, each
+    simulation prints its estimated variance reduction. `screen_sigmas` is
+    the `k` of `EdgeScreen`, or `None` to keep every edge. With `batched`,
+    the trials of a task are solved together, see `BatchAssignmentSolver`.
+    `speculative_sigmas` is the number of empty buckets whose sigmas are
+    simulated together, see `create_interview_list`. `candidates` is one of
+    `CANDIDATE_SETS`.
+    """
+    unknown = set(options) - set(simulation_options)
+    if unknown:
+        raise ValueError(f'Unknown simulation options {sorted(unknown)}')
+    if options.get('noise', 'iid') not in NOISE_MODES:
+        raise ValueError(f'Unknown noise {options["noise"]}, expected one of '
+                         f'{list(NOISE_MODES)}')
+    if options.get('candidates', 'all') not in CANDIDATE_SETS:
+        raise ValueError(f'Unknown candidates {options["candidates"]}, '
+                         f'expected one of {list(CANDIDATE_SETS)}')
+    simulation_options.update(options)
+
+
+def candidate_pairs(student_data: pd.DataFrame, course_data: pd.DataFrame,
+                    candidates: str) -> Optional[np.ndarray]:
+    """
+    Pairs the trials may match besides the courses each student listed, as a
+    (students, courses) mask: every pair ('all', `None`), no other pair
+    ('listed'), or the courses sharing an 'Area' with a course the student
+    listed ('area')
+    """
+    if candidates == 'all':
+        return None
+    shape = len(student_data.index), len(course_data.index)
+    if candidates == 'listed':
+        return np.zeros(shape, dtype=bool)
+    areas = course_data['Area'].str.split(';').explode()
+    names = pd.Index(pd.unique(areas[areas != ''].to_numpy()))
+    course_areas = matching.count_names(course_data['Area'], names) > 0
+    listed = student_data.ranks.matrices(course_data.index)[0] != 0
+    return (listed.astype(np.int64) @ course_areas @ course_areas.T) > 0
 
 
 def calculate_l2norm_for_uniform_entries(matched_students: int,
@@ -23,16 +100,32 @@ def calculate_l2norm_for_uniform_entries(matched_students: int,
 
 
 def add_noise_and_get_matching_interviews(stddev: float,
-                                          base_weights: np.ndarray,
+                                          base_weights: EdgeWeights,
                                           student_weight_data: pd.DataFrame,
                                           course_graph_data: pd.DataFrame,
-                                          fixed_matches: pd.DataFrame) -> Tuple[
-    List[Tuple[int, int]], int]:
-    noise = np.random.normal(0, stddev, base_weights.shape)
-    new_weights = base_weights + noise
-    graph = min_cost_flow.MatchingGraph(
-        new_weights, student_weight_data, course_graph_data, fixed_matches)
-    if not graph.solve():
+                                          fixed_matches: pd.DataFrame,
+                                          graph: min_cost_flow.MatchingGraph = None,
+                                          rng: np.random.Generator = None,
+                                          noise: np.ndarray = None) -> \
+        Tuple[List[Tuple[int, int]], int]:
+    """
+    Reuses `graph` (built from the same inputs) if given. The noise is
+    `stddev` times the standard normal draws `noise`, or times draws from
+    `rng`, or from a freshly seeded generator.
+    """
+    if noise is None:
+        if rng is None:
+            rng = np.random.default_rng()
+        noise = rng.standard_normal(len(base_weights))
+    noise = stddev * noise
+    new_weights = base_weights.with_values(base_weights.values + noise)
+    if graph is None:
+        graph = min_cost_flow.MatchingGraph(
+            new_weights, student_weight_data, course_graph_data,
+            fixed_matches)
+    else:
+        graph.update_match_weights(new_weights)
+    if not graph.solve(cached=False):
         print('Problem optimizing flow')
         graph.print()
         return [], -1
@@ -41,52 +134,386 @@ def add_noise_and_get_matching_interviews(stddev: float,
     return match, unfilled_slots
 
 
+def standard_noise(mode: str, trials: int, edges: int,
+                   rng: np.random.Generator) -> np.ndarray:
+    """
+    (trials, edges) standard normal draws. 'iid' draws are independent;
+    'antithetic' draws come in pairs of opposite signs; 'sobol' draws map
+    scrambled Sobol' points through the normal inverse CDF, with blocks of at
+    most `qmc.Sobol.MAXDIM` edges scrambled independently.
+    """
+    if mode == 'antithetic':
+        half = rng.standard_normal(((trials + 1) // 2, edges))
+        return np.stack([half, -half], axis=1).reshape(-1, edges)[:trials]
+    if mode == 'sobol':
+        points = np.hstack([
+            qmc.Sobol(min(qmc.Sobol.MAXDIM, edges - start), scramble=True,
+                      seed=rng).random(trials)
+            for start in range(0, edges, qmc.Sobol.MAXDIM)])
+        return special.ndtri(np.clip(points, 1e-10, 1 - 1e-10))
+    return rng.standard_normal((trials, edges))
+
+
+class TrialCounts:
+    """
+    Matches counted over trials run in independent tasks. The spread between
+    the tasks estimates the variance of the chances, even when the trials of
+    a task are not independent.
+    """
+
+    def __init__(self, shape: Tuple[int, int]):
+        self.trials = 0
+        self.tasks = 0
+        self.counts = np.zeros(shape, dtype=np.int64)
+        # sums over the tasks of their counts squared, of their counts times
+        # their number of trials, and of their numbers of trials squared
+        self.squares = np.zeros(shape)
+        self.scaled = np.zeros(shape)
+        self.sizes_squared = 0
+
+    def add_task(self, counts: np.ndarray, trials: int):
+        self.trials += trials
+        self.tasks += 1
+        self.counts += counts
+        self.squares += counts.astype(np.float64) ** 2
+        self.scaled += counts * float(trials)
+        self.sizes_squared += trials ** 2
+
+    def merge(self, other: 'TrialCounts'):
+        self.trials += other.trials
+        self.tasks += other.tasks
+        self.counts += other.counts
+        self.squares += other.squares
+        self.scaled += other.scaled
+        self.sizes_squared += other.sizes_squared
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {'counts': self.counts, 'squares': self.squares,
+                'scaled': self.scaled,
+                'sizes': np.array([self.trials, self.tasks,
+                                   self.sizes_squared])}
+
+    @staticmethod
+    def from_arrays(arrays: Dict[str, np.ndarray]) -> 'TrialCounts':
+        total = TrialCounts(arrays['counts'].shape)
+        total.counts += arrays['counts']
+        total.squares += arrays['squares']
+        total.scaled += arrays['scaled']
+        total.trials, total.tasks, total.sizes_squared = (
+            int(size) for size in arrays['sizes'])
+        return total
+
+    def chances(self) -> np.ndarray:
+        return self.counts / self.trials
+
+    def variance(self) -> np.ndarray:
+        """ Estimated variance of `chances`, from the spread between tasks """
+        if self.tasks < 2:
+            return np.full(self.counts.shape, np.nan)
+        chances = self.chances()
+        spread = (self.squares - 2 * chances * self.scaled +
+                  chances ** 2 * self.sizes_squared)
+        return self.tasks / (self.tasks - 1) * spread / self.trials ** 2
+
+    def variance_reduction(self) -> float:
+        """
+        Variance the chances would have with independent trials over their
+        estimated variance, both summed over the cells; 1 if there is no
+        estimate
+        """
+        chances = self.chances()
+        independent = (chances * (1 - chances)).sum() / self.trials
+        estimated = self.variance().sum()
+        if not estimated > 0 or not independent > 0:
+            return 1.0
+        return float(independent / estimated)
+
+
+class EdgeScreen:
+    """
+    Screens out the edges that are unlikely to be matched in a noisy trial.
+    An edge can only be matched if the noise pays for a cycle through it in
+    the residual graph of the noiseless optimum, and the cheapest such cycle
+    costs `margins` (see `ResidualGraph.forced_costs`) with noise of standard
+    deviation sigma * sqrt(`cycle_arcs`) on it. Edges whose margin is over
+    `k` of those standard deviations are dropped; the chance that the
+    cheapest cycle of a dropped edge pays off is reported, not bounded over
+    every cycle.
+    """
+
+    def __init__(self, context: TrialContext, k: float):
+        self.k = k
+        graph = build_trial_graph(context)
+        if not graph.solve(cached=False):
+            raise ValueError('Cannot screen the edges of an unsolvable graph')
+        costs, self.cycle_arcs = \
+            residual_graph.ResidualGraph(graph).forced_costs()
+        self.margins = costs / 10 ** min_cost_flow.DIGITS
+
+    def keep(self, sigma: float) -> np.ndarray:
+        """ Mask of the edges kept for `sigma`, and of those without arcs """
+        return ~(self.margins > self.k * sigma * np.sqrt(self.cycle_arcs))
+
+    def dropped_chance(self, sigma: float) -> float:
+        """
+        Sum over the dropped edges of the chance that the noise pays for
+        their cheapest cycle in a trial, which bounds the chance that any
+        does
+        """
+        dropped = ~self.keep(sigma)
+        with np.errstate(divide='ignore'):
+            return float(special.ndtr(-self.margins[dropped] / (
+                    sigma * np.sqrt(self.cycle_arcs[dropped]))).sum())
+
+
+class TrialGraphs:
+    """
+    Graph of the trials of a sigma and its base weights: with a `screen`,
+    built from the edges kept for the sigma, otherwise from every edge. Only
+    the graph of the last sigma is kept, with its batch solver if any.
+    """
+
+    def __init__(self, context: TrialContext,
+                 screen: Optional[EdgeScreen] = None):
+        self.context = context
+        self.screen = screen
+        self._key = None
+        self._graph = None
+        self._batch_solver = None
+
+    def for_sigma(self, sigma: float) -> Tuple[
+            min_cost_flow.MatchingGraph, EdgeWeights, np.ndarray]:
+        """ The graph, its base weights, and the mask of the edges in it """
+        base_weights = self.context[0]
+        key = None if self.screen is None else sigma
+        if self._graph is None or key != self._key:
+            keep = np.ones(len(base_weights), dtype=bool)
+            if self.screen is not None:
+                keep = self.screen.keep(sigma)
+            weights = EdgeWeights(
+                base_weights.students[keep], base_weights.courses[keep],
+                base_weights.values[keep], base_weights.shape)
+            self._key = key
+            self._graph = build_trial_graph((weights, *self.context[1:])), \
+                weights, keep
+            self._batch_solver = None
+        return self._graph
+
+    def batch_solver(self, sigma: float) -> flow_solvers.BatchAssignmentSolver:
+        """ Solver of the trials of the graph of `sigma` in batches """
+        graph = self.for_sigma(sigma)[0]
+        if self._batch_solver is None:
+            self._batch_solver = flow_solvers.BatchAssignmentSolver(graph)
+        return self._batch_solver
+
+
+class TrialRunner:
+    """
+    Runs noisy trials of the matching, with `jobs` processes if more than
+    one. The trials are run in tasks of `TRIALS_PER_TASK`, and each task
+    draws its noise from a stream keyed by the seed, sigma (unless the noise
+    is common to every sigma) and its first trial, so the counts for a seed
+    do not depend on the number of processes. The noise is drawn for every
+    edge, also those dropped by the `screen`. With a `store`, the counts of
+    each run of trials are read from it if it has them, and written to it
+    otherwise.
+    """
+
+    def __init__(self, context: TrialContext, seed: Optional[int] = None,
+                 jobs=1, noise='iid', common_noise=False,
+                 screen: Optional[EdgeScreen] = None, batched=False,
+                 store: Optional[trial_store.TrialStore] = None):
+        self.context = context
+        self.noise = noise
+        self.batched = batched
+        self.common_noise = common_noise
+        self.screen = screen
+        self.store = store
+        # the entropy of an unseeded run is drawn once, so its tasks are
+        # still independent
+        if store is None:
+            self.seed = np.random.SeedSequence(seed).entropy
+        else:
+            self.seed = store.entropy(seed)
+            options = {option: value for option, value in
+                       simulation_options.items()
+                       if option not in STORE_IGNORED_OPTIONS}
+            options.update(noise=noise, common_noise=common_noise,
+                           batched=batched,
+                           graph=dict(min_cost_flow.graph_options),
+                           trials_per_task=TRIALS_PER_TASK)
+            store.open_run(self.seed, options)
+        self.pool = None
+        self.graphs = None
+        if jobs > 1:
+            self.pool = ProcessPoolExecutor(
+                max_workers=jobs, initializer=_init_trial_worker,
+                initargs=(context, screen, dict(min_cost_flow.graph_options)))
+        else:
+            self.graphs = TrialGraphs(context, screen)
+
+    def run(self, sigma: float, trials: int, first_trial=0) -> TrialCounts:
+        """
+        Number of times each student is matched to each course in the trials
+        numbered from `first_trial`, as a (students, courses) matrix
+        """
+        return self.run_many([(sigma, trials, first_trial)])[0]
+
+    def run_many(self, runs: List[Tuple[float, int, int]]) -> List[
+            TrialCounts]:
+        """
+        `run` for each (sigma, trials, first trial) of `runs`, with the tasks
+        of every run not in the store given to the pool at once
+        """
+        totals = [None] * len(runs)
+        if self.store is not None:
+            for i, run in enumerate(runs):
+                arrays = self.store.load(*run)
+                if arrays is not None:
+                    totals[i] = TrialCounts.from_arrays(arrays)
+        tasks, owners = [], []
+        for i, (sigma, trials, first_trial) in enumerate(runs):
+            if totals[i] is not None:
+                continue
+            totals[i] = TrialCounts(trial_shape(self.context))
+            for start in range(first_trial, first_trial + trials,
+                               TRIALS_PER_TASK):
+                tasks.append(
+                    (sigma, min(TRIALS_PER_TASK, first_trial + trials - start),
+                     self.task_seed(sigma, start), self.noise, self.batched))
+                owners.append(i)
+        if self.pool is None:
+            counts = (count_matches(self.graphs, *task) for task in tasks)
+        else:
+            counts = self.pool.map(_count_worker_matches, tasks)
+        for k, ((_, task_trials, *_), task_counts) in enumerate(
+                zip(tasks, counts)):
+            i = owners[k]
+            totals[i].add_task(task_counts, task_trials)
+            # the tasks of a run are consecutive, so it is complete
+            if self.store is not None and owners[k + 1:k + 2] != [i]:
+                self.store.save(*runs[i], totals[i].to_arrays())
+        return totals
+
+    def task_seed(self, sigma: float, first_trial: int) -> \
+            np.random.SeedSequence:
+        if self.common_noise:
+            return np.random.SeedSequence(self.seed, spawn_key=(first_trial,))
+        sigma_key = int(np.float64(sigma).view(np.uint64))
+        return np.random.SeedSequence(
+            self.seed, spawn_key=(sigma_key, first_trial))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def trial_shape(context: TrialContext) -> Tuple[int, int]:
+    _, student_weight_data, course_graph_data, _ = context
+    return len(student_weight_data.index), len(course_graph_data.index)
+
+
+def build_trial_graph(context: TrialContext) -> min_cost_flow.MatchingGraph:
+    base_weights, student_weight_data, course_graph_data, fixed_matches = \
+        context
+    return min_cost_flow.MatchingGraph(
+        base_weights, student_weight_data, course_graph_data, fixed_matches)
+
+
+def count_matches(graphs: TrialGraphs, sigma: float, trials: int,
+                  seed: np.random.SeedSequence, noise='iid',
+                  batched=False) -> np.ndarray:
+    """
+    Number of times each student is matched to each course in `trials`
+    trials with noise drawn from `seed`, see `standard_noise`. Trials that
+    leave slots unfilled are not counted. If `batched`, the trials are solved
+    together by a `BatchAssignmentSolver`, otherwise one at a time.
+    """
+    _, student_weight_data, course_graph_data, fixed_matches = graphs.context
+    graph, weights, keep = graphs.for_sigma(sigma)
+    draws = standard_noise(
+        noise, trials, len(keep), np.random.default_rng(seed))
+    shape = trial_shape(graphs.context)
+    if batched:
+        courses = graphs.batch_solver(sigma).solve(graph.batch_costs(
+            weights.values + sigma * draws[:, keep]))
+        if courses is None:
+            print('Problem optimizing flow')
+            graph.print()
+            return np.zeros(shape, dtype=np.int64)
+        courses = courses[(courses >= 0).sum(axis=1) == graph.slots]
+        students = np.broadcast_to(np.arange(shape[0]), courses.shape)
+        matched = courses >= 0
+        return np.bincount(
+            students[matched] * shape[1] + courses[matched],
+            minlength=shape[0] * shape[1]).reshape(shape)
+    counts = np.zeros(shape, dtype=np.int64)
+    for trial_draws in draws:
+        matching, unfilled = add_noise_and_get_matching_interviews(
+            sigma, weights, student_weight_data, course_graph_data,
+            fixed_matches, graph, noise=trial_draws[keep])
+        if unfilled == 0:
+            matches = np.array(matching, dtype=int).reshape(-1, 2)
+            matches = matches[(matches != -1).all(axis=1)]
+            # a matching has each (student, course) pair at most once
+            counts[matches[:, 0], matches[:, 1]] += 1
+    return counts
+
+
+def _init_trial_worker(context: TrialContext, screen: Optional[EdgeScreen],
+                       graph_options: dict):
+    global _worker_state
+    min_cost_flow.configure(**graph_options)
+    _worker_state = TrialGraphs(context, screen)
+
+
+def _count_worker_matches(
+        task: Tuple[float, int, np.random.SeedSequence, str, bool]) -> \
+        np.ndarray:
+    return count_matches(_worker_state, *task)
+
+
 def run_trials(sigma: float, trials_to_run: int,
-               base_weights: np.ndarray,
+               base_weights: EdgeWeights,
                student_weight_data: pd.DataFrame,
                course_graph_data: pd.DataFrame,
-               fixed_matches: pd.DataFrame) -> np.ndarray:
-    courses = len(course_graph_data.index)
-    students = len(student_weight_data.index)
-    trial = np.zeros((students, courses), dtype=np.float64)
-    for _ in range(trials_to_run):
-        matching, unfilled = add_noise_and_get_matching_interviews(
-            sigma, base_weights, student_weight_data, course_graph_data,
-            fixed_matches)
-        if unfilled == 0:
-            for si, ci in matching:
-                if si != -1 and ci != -1:
-                    trial[si, ci] += 1.0
-    return trial
+               fixed_matches: pd.DataFrame, seed: Optional[int] = None,
+               jobs=1) -> np.ndarray:
+    with TrialRunner((base_weights, student_weight_data, course_graph_data,
+                      fixed_matches), seed, jobs) as runner:
+        return runner.run(sigma, trials_to_run).counts
 
 
-def check_caps(course_data: pd.DataFrame, recent_simulation: np.ndarray,
-               batch_num: int, num_trials: int,
-               previous_simulations_percentages: np.ndarray) -> bool:
-    courses = len(course_data.index)
-    comparisons = np.absolute(
-        (recent_simulation / num_trials) - previous_simulations_percentages)
-    hard_cap = (comparisons >= 0.05).sum()
-    if hard_cap == 0:
-        soft_cap = (comparisons >= 0.02).sum(axis=0)
-        courses_above_soft_cap = []
-        for ci in range(courses):
-            ci_slots = course_data.iloc[ci]['Slots']
-            if soft_cap[ci] > int(ci_slots * 0.45):
-                courses_above_soft_cap.append(
-                    (course_data.index[ci], soft_cap[ci], ci_slots))
-
-        if len(courses_above_soft_cap) == 0:
-            print(
-                f"Stopping after batch {batch_num} with {num_trials} trials due to being under the soft cap")
-            return True
-        else:
-            print(
-                f"After batch {batch_num} with {num_trials} trials, above soft cap ('Course', 'TAs > 2%', 'Slots'): {courses_above_soft_cap}")
-    else:
-        print(
-            f"After batch {batch_num} with {num_trials} trials, still {hard_cap} differences above 0.05")
-    return False
+def wilson_interval(chances: np.ndarray, trials: float,
+                    z: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lower and upper bounds of the Wilson score interval of the chance of
+    each cell, estimated from `trials` (possibly effective) trials, at `z`
+    standard deviations
+    """
+    scale = 1 + z ** 2 / trials
+    center = (chances + z ** 2 / (2 * trials)) / scale
+    half_width = z * np.sqrt(
+        chances * (1 - chances) / trials + z ** 2 / (4 * trials ** 2)) / scale
+    return center - half_width, center + half_width
+
+
+def unsettled_precision(chances: np.ndarray, trials: float, z: float) -> \
+        Tuple[int, float]:
+    """
+    Number of cells whose confidence interval contains `REPORT_THRESHOLD`,
+    and the largest half-width of their intervals (0 if there are none)
+    """
+    low, high = wilson_interval(chances, trials, z)
+    unsettled = (low <= REPORT_THRESHOLD) & (high >= REPORT_THRESHOLD)
+    half_widths = (high - low)[unsettled] / 2
+    return int(unsettled.sum()), float(half_widths.max(initial=0.0))
 
 
 def insert_into_buckets(buckets: BucketsType,
@@ -105,29 +532,72 @@ def insert_into_buckets(buckets: BucketsType,
             return
 
 
-def run_single_simulation(sigma: float, weights: np.ndarray,
-                          course_data: pd.DataFrame,
-                          student_weight_data: pd.DataFrame,
-                          course_graph_data: pd.DataFrame,
-                          fixed_matches: pd.DataFrame):
-    trials = 50
-    sim_trials = trials
-    sim_matches = run_trials(
-        sigma, trials, weights, student_weight_data, course_graph_data,
-        fixed_matches)
-    for i in range(1, 10):
-        trial_matches = run_trials(
-            sigma, trials, weights, student_weight_data, course_graph_data,
-            fixed_matches)
-        sim_matches += trial_matches
-        sim_trials += trials
-        percent_decimals = trial_matches / trials
-        if check_caps(
-                course_data, sim_matches, i, sim_trials, percent_decimals):
-            break
-        trials *= 2
-    simulation_percentages = sim_matches / sim_trials
-    return simulation_percentages
+def run_simulations(sigmas: List[float], runner: TrialRunner,
+                    confidence=0.95, precision=0.01,
+                    max_trials=25600) -> List[Tuple[np.ndarray, float]]:
+    """
+    Runs batches of trials for each of `sigmas`, each batch as large as all
+    the previous ones of its sigma, until the `confidence` interval of the
+    chance of every student being matched to every course is either entirely
+    on one side of `REPORT_THRESHOLD` or at most `precision` wide on each
+    side, or `max_trials` are run. The batches of every sigma still running
+    are given to the runner together. Unless the noise is 'iid', the
+    intervals are computed from the effective number of trials: the trials
+    times their estimated variance reduction. Returns for each sigma the
+    chances and the achieved precision: the largest half-width of the
+    intervals still containing the threshold.
+    """
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    labels = [f"Sigma {sigma}: " if len(sigmas) > 1 else "" for sigma in
+              sigmas]
+    if runner.screen is not None:
+        for sigma, label in zip(sigmas, labels):
+            keep = runner.screen.keep(sigma)
+            print(
+                f"{label}Screening keeps {keep.sum()} of {len(keep)} edges, the cheapest cycles of the dropped ones pay off with total chance {runner.screen.dropped_chance(sigma):.2e} per trial")
+    all_counts = runner.run_many(
+        [(sigma, 2 * TRIALS_PER_TASK, 0) for sigma in sigmas])
+    results = [None] * len(sigmas)
+    batch_num = 0
+    running = list(range(len(sigmas)))
+    while running:
+        continuing = []
+        for i in running:
+            sim_counts, label = all_counts[i], labels[i]
+            reduction = sim_counts.variance_reduction()
+            effective = sim_counts.trials
+            if runner.noise != 'iid':
+                effective *= reduction
+            unsettled, half_width = unsettled_precision(
+                sim_counts.chances(), effective, z)
+            if half_width > precision and sim_counts.trials < max_trials:
+                print(
+                    f"{label}After batch {batch_num} with {sim_counts.trials} trials, {unsettled} chances around {REPORT_THRESHOLD:.0%} are within ±{half_width:.4f}")
+                continuing.append(i)
+                continue
+            print(
+                f"{label}Stopping after batch {batch_num} with {sim_counts.trials} trials, {unsettled} chances around {REPORT_THRESHOLD:.0%} are within ±{half_width:.4f}")
+            if simulation_options['report_variance']:
+                print(
+                    f"{label}Variance reduction over independent trials: {reduction:.2f}x ({runner.noise} noise)")
+            results[i] = sim_counts.chances(), half_width
+        more = runner.run_many(
+            [(sigmas[i], min(all_counts[i].trials,
+                             max_trials - all_counts[i].trials),
+              all_counts[i].trials) for i in continuing])
+        for i, more_counts in zip(continuing, more):
+            all_counts[i].merge(more_counts)
+        running = continuing
+        batch_num += 1
+    return results
+
+
+def run_single_simulation(sigma: float, runner: TrialRunner,
+                          confidence=0.95, precision=0.01,
+                          max_trials=25600) -> Tuple[np.ndarray, float]:
+    """ `run_simulations` for a single sigma """
+    return run_simulations(
+        [sigma], runner, confidence, precision, max_trials)[0]
 
 
 def initialize_cumulative_percentages(students: int, courses: int,
@@ -140,7 +610,13 @@ def initialize_cumulative_percentages(students: int, courses: int,
     return cumulative_percentages
 
 
-def choose_sigma(buckets: BucketsType, bucket_index: int) -> float:
+def sigma_bracket(buckets: BucketsType, bucket_index: int) -> Tuple[
+        float, float]:
+    """
+    Largest sigma of the buckets of larger norms and smallest sigma of the
+    buckets of smaller norms, or 0 and 5 if they are empty: the sigmas of
+    the bucket lie between them
+    """
     def get_smallest_larger_min() -> float:
         for i in range(bucket_index - 1, -1, -1):
             if 0 < buckets[i][2] < sys.maxsize:
@@ -153,58 +629,246 @@ def choose_sigma(buckets: BucketsType, bucket_index: int) -> float:
                 return buckets[i][1]
         return 0.0
 
-    min_sigma = get_smallest_larger_min()
-    max_sigma = get_greatest_smaller_max()
+    return get_greatest_smaller_max(), get_smallest_larger_min()
+
 
+def choose_sigma(buckets: BucketsType, bucket_index: int) -> float:
+    max_sigma, min_sigma = sigma_bracket(buckets, bucket_index)
     return min_sigma * 0.5 + max_sigma * 0.5
 
 
+def decreasing_fit(values: np.ndarray) -> np.ndarray:
+    """
+    Closest non-increasing sequence to `values` in least squares, by pooling
+    adjacent violators
+    """
+    pools = []  # (mean, size)
+    for value in values:
+        pools.append((float(value), 1))
+        while len(pools) > 1 and pools[-2][0] < pools[-1][0]:
+            (mean, size), (last_mean, last_size) = pools[-2], pools[-1]
+            pools[-2:] = [((mean * size + last_mean * last_size) / (
+                    size + last_size), size + last_size)]
+    return np.repeat([mean for mean, _ in pools], [size for _, size in pools])
+
+
+class NormModel:
+    """
+    Monotone interpolation of the norm of the simulation percentages as a
+    function of sigma, from the noiseless matching (sigma 0) and every
+    simulation run so far. The norm falls as sigma grows, so the observed
+    norms, which carry the noise of the trials, are first fitted by a
+    non-increasing sequence.
+    """
+
+    def __init__(self, noiseless_norm: float):
+        self.sigmas = [0.0]
+        self.norms = [noiseless_norm]
+
+    def add(self, sigma: float, norm: float):
+        self.sigmas.append(sigma)
+        self.norms.append(norm)
+
+    def sigma_for(self, norm: float) -> Optional[float]:
+        """
+        Sigma whose simulation is expected to have `norm`, or `None` before
+        any simulation. Below the smallest norm seen, the last segment of the
+        fit is extended, up to twice the largest sigma.
+        """
+        order = np.argsort(self.sigmas, kind='stable')
+        sigmas = np.asarray(self.sigmas)[order]
+        fitted = decreasing_fit(np.asarray(self.norms)[order])
+        # each distinct norm of the fit at the mean sigma fitted to it
+        levels, inverse = np.unique(fitted, return_inverse=True)
+        if len(levels) < 2:
+            return None
+        level_sigmas = np.bincount(inverse, sigmas) / np.bincount(inverse)
+        if norm < levels[0]:
+            slope = (level_sigmas[1] - level_sigmas[0]) / (
+                    levels[1] - levels[0])
+            return float(min(level_sigmas[0] + slope * (norm - levels[0]),
+                             2 * level_sigmas[0]))
+        if norm > levels[-1]:
+            return float(level_sigmas[-1])
+        return float(interpolate.PchipInterpolator(levels, level_sigmas)(norm))
+
+
+def propose_sigma(buckets: BucketsType, bucket_index: int,
+                  model: NormModel) -> float:
+    """
+    Sigma whose simulation `model` expects in the middle of the bucket, kept
+    inside the bracket of `sigma_bracket` away from its ends; the midpoint of
+    the bracket (`choose_sigma`) while the model cannot tell
+    """
+    low, high = sigma_bracket(buckets, bucket_index)
+    upper = buckets[bucket_index][0]
+    if bucket_index > 0:
+        target = (buckets[bucket_index - 1][0] + upper) / 2
+    elif len(buckets) > 1:
+        target = upper - (buckets[1][0] - upper) / 2
+    else:
+        target = upper / 2
+    sigma = model.sigma_for(target)
+    if sigma is None or sigma in model.sigmas:
+        return choose_sigma(buckets, bucket_index)
+    margin = (high - low) / 8
+    return float(np.clip(sigma, low + margin, high - margin))
+
+
+def simulation_context(course_data: pd.DataFrame, student_data: pd.DataFrame,
+                       fixed_matches: pd.DataFrame,
+                       adjusted_path: str) -> TrialContext:
+    """
+    Context of the trials: the weights of the candidate pairs (see
+    `configure`) without the instructor preferences, and the data of the
+    graph
+    """
+    # the pairs other than the listed ones get a weight of 0.0
+    weights = matching.match_weights(
+        student_data, course_data, adjusted_path, 0.0, True,
+        candidate_pairs(student_data, course_data,
+                        simulation_options['candidates']))
+    print(f"Interview trials use {len(weights)} of {np.prod(weights.shape)} "
+          f"pairs ({simulation_options['candidates']} candidates)")
+    return weights, student_data['Weight'], course_data[
+        ['Slots', 'Base weight', 'First weight']], fixed_matches
+
+
 def create_interview_list(course_data: pd.DataFrame, student_data: pd.DataFrame,
                           fixed_matches: pd.DataFrame, adjusted_path: str,
                           output_path: str,
-                          initial_matches: List[Tuple[int, int]]):
+                          initial_matches: List[Tuple[int, int]],
+                          seed: Optional[int] = None, jobs=1,
+                          confidence=0.95, precision=0.01,
+                          store: Optional[trial_store.TrialStore] = None):
+    """
+    The noisy trials are run by `jobs` processes, and are the same for any
+    number of processes given a `seed`. Each simulation runs until the chances
+    are settled to `confidence` and `precision`, see `run_simulations`.
+    The sigmas of the first `speculative_sigmas` empty buckets (see
+    `configure`) are proposed by a `NormModel` and simulated together. The
+    noise is drawn as set by `configure`. With a `store`, the trials already
+    in it are not run again; the buckets are then filled again from their
+    counts, since the sigmas proposed only depend on the counts.
+    """
     final_denominator = 4
     buckets = initialize_buckets(
         course_data[['Slots']].sum(),
         final_denominator, len(fixed_matches.index))
 
-    # binary search one at a time until I get the desired length for a specific
-    # bucket, but append any result to the buckets
-    student_weight_data = student_data['Weight']
-    course_graph_data = course_data[['Slots', 'Base weight', 'First weight']]
+    # fill the buckets in order, proposing sigmas from the norms of the
+    # simulations so far, but append any result to the buckets
     cumulative_percentages = initialize_cumulative_percentages(
         len(student_data.index), len(course_data.index), initial_matches)
 
-    # TODO: the default value of 0.0 is the value to change in case you want to
-    #  limit the simulations to only allowing a student to match with courses
-    #  they listed
-    weights = matching.match_weights(
-        student_data, course_data, adjusted_path, 0.0, True)
-    for simulation_num in range(len(buckets)):
-        while len(buckets[simulation_num][3]) == 0:
-            sigma = choose_sigma(buckets, simulation_num)
+    # largest half-width of the confidence intervals of the chances that
+    # are not settled to be above or below the reported threshold
+    achieved = 0.0
+    context = simulation_context(
+        course_data, student_data, fixed_matches, adjusted_path)
+    screen = None
+    if simulation_options['screen_sigmas'] is not None:
+        screen = EdgeScreen(context, simulation_options['screen_sigmas'])
+    model = NormModel(float(np.linalg.norm(cumulative_percentages)))
+    simulations = 0
+    # buckets whose norms no sigma reaches, as the candidates may not let the
+    # chances spread that much
+    unreachable = set()
+    with TrialRunner(context, seed, jobs, simulation_options['noise'],
+                     simulation_options['common_noise'], screen,
+                     simulation_options['batched'], store) as runner:
+        while True:
+            empty = [i for i, bucket in enumerate(buckets)
+                     if not bucket[3] and i not in unreachable]
+            if not empty:
+                break
+            sigmas, targets = [], []
+            for i in empty[:simulation_options['speculative_sigmas']]:
+                low, high = sigma_bracket(buckets, i)
+                if high - low < SIGMA_RESOLUTION:
+                    print(
+                        f"Leaving bucket {i} empty, no sigma between {low} and {high} reaches it")
+                    unreachable.add(i)
+                    continue
+                sigma = propose_sigma(buckets, i, model)
+                if sigma not in sigmas:
+                    sigmas.append(sigma)
+                    targets.append(i)
+            if not sigmas:
+                continue
             print(
-                f"Starting simulation for bucket {simulation_num} with sigma {sigma}")
-            simulation_percentages = run_single_simulation(
-                sigma, weights, course_data, student_weight_data,
-                course_graph_data, fixed_matches)
-            insert_into_buckets(buckets, simulation_percentages, sigma)
+                f"Starting simulations for buckets {targets} with sigmas {sigmas}")
+            for sigma, (simulation_percentages, half_width) in zip(
+                    sigmas, run_simulations(
+                        sigmas, runner, confidence, precision)):
+                achieved = max(achieved, half_width)
+                insert_into_buckets(buckets, simulation_percentages, sigma)
+                model.add(sigma, float(np.linalg.norm(simulation_percentages)))
+                simulations += 1
 
     buckets_to_print = []
+    filled = 0
     for desired_thresh, _, _, sim_list in buckets:
+        if not sim_list:
+            continue
+        filled += 1
         average_sigma = 0.0
         for simulation, sigma in sim_list:
             cumulative_percentages += simulation / len(sim_list)
             average_sigma += sigma
         buckets_to_print.append((desired_thresh, average_sigma / len(sim_list)))
     print(f"Finished with buckets (thresholds, mean sigma): {buckets_to_print}")
+    print(f"Filled {filled} of {len(buckets)} buckets with {simulations} simulations")
+    print(f"Chances around {REPORT_THRESHOLD:.0%} are within ±{achieved:.4f}")
 
-    cumulative_percentages *= 100.0 / (len(buckets) + 1)
+    cumulative_percentages *= 100.0 / (filled + 1)
     weighted_percentages = parse_simulations_output(
         course_data, student_data, cumulative_percentages)
     write_simulations_output(output_path, weighted_percentages)
 
 
+def create_interview_shortlist(course_data: pd.DataFrame,
+                               student_data: pd.DataFrame,
+                               fixed_matches: pd.DataFrame, adjusted_path: str,
+                               output_path: str, per_slot: int):
+    """
+    Deterministic alternative to `create_interview_list` from a single solve
+    of the graph of the trials without noise: for every course, the
+    `per_slot` times its slots students whose forced match to the course
+    lowers the optimal weight the least (see `ResidualGraph.forced_costs`),
+    its matched students first at no cost. Pairs that cannot be matched
+    together are left out.
+    """
+    context = simulation_context(
+        course_data, student_data, fixed_matches, adjusted_path)
+    weights = context[0]
+    graph = build_trial_graph(context)
+    if not graph.solve(cached=False):
+        print('Problem optimizing flow')
+        graph.print()
+        return
+    costs, _ = residual_graph.ResidualGraph(graph).forced_costs()
+    # weight lost by forcing each pair, infinite without a cycle or an arc
+    lost = np.full(trial_shape(context), np.inf)
+    lost[weights.students, weights.courses] = np.nan_to_num(
+        costs, nan=np.inf) / 10 ** min_cost_flow.DIGITS
+    for si, ci in graph.get_matching(fixed_matches, weights):
+        if si != -1 and ci != -1:
+            lost[si, ci] = 0.0
+
+    shortlists = {}
+    for ci, course in enumerate(course_data.index):
+        # ties are listed by student order, so the shortlist is stable
+        order = np.lexsort((np.arange(len(lost)), lost[:, ci]))
+        order = order[np.isfinite(lost[order, ci])][
+                :per_slot * int(course_data.iloc[ci]['Slots'])]
+        shortlists[course] = [
+            (student_data.index[si], student_data.iloc[si]['Name'],
+             lost[si, ci]) for si in order]
+    write_simulations_output(output_path, shortlists,
+                             'interview_shortlist.csv', 'Weight Cost')
+
+
 def initialize_buckets(filled_slots: int, final_denominator: int,
                        fixed_slots: int) -> BucketsType:
     initial_buckets = []  # sorted from highest to lowest
@@ -237,7 +901,7 @@ def parse_simulations_output(course_data: pd.DataFrame,
     for ci in range(courses):
         sorted_matches = []
         for si in range(students):
-            if percentages[si, ci] > 2.0:
+            if percentages[si, ci] > 100.0 * REPORT_THRESHOLD:
                 netid = student_data.index[si]
                 name = student_data.iloc[si]['Name']
                 percent = percentages[si, ci]
@@ -248,10 +912,12 @@ def parse_simulations_output(course_data: pd.DataFrame,
 
 
 def write_simulations_output(output_path: str, readable_matches: Dict[
-    str, List[Tuple[str, str, float]]]):
-    with open(output_path + 'interview_simulations.csv', 'w+') as f:
+    str, List[Tuple[str, str, float]]],
+                             filename='interview_simulations.csv',
+                             value_column='Percent Chance'):
+    with open(output_path + filename, 'w+') as f:
         writer = csv.writer(f)
-        writer.writerow(['Course', 'NetID', 'Name', 'Percent Chance'])
+        writer.writerow(['Course', 'NetID', 'Name', value_column])
         flattened = []
         for course, details in readable_matches.items():
             for netid, name, percentage in details:
@@ -0,0 +1,139 @@
+import heapq
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+import min_cost_flow
+
+# (student index, course index or -1 for unassigned) pairs
+Choices = Tuple[Tuple[int, int], ...]
+# choices a subproblem forces and choices it excludes
+Partition = Tuple[Choices, Choices]
+# cost and arc flows of a solved matching
+Solution = Tuple[int, np.ndarray]
+
+# graph, its unedited checkpoint and the bonus of a worker process
+_worker_state = None
+
+
+def k_best_matchings(graph: min_cost_flow.MatchingGraph, k: int,
+                     jobs=1) -> List[Solution]:
+    """
+    Returns the `k` lowest cost matchings of `graph` in which the students
+    without a fixed match are assigned differently, best first, with their
+    exact costs (fewer if there are not as many). Uses Murty's partitioning:
+    after a solution is taken, the rest of its subproblem is split into one
+    subproblem per free student, which keeps the choices of the earlier
+    students and excludes the student's own choice. The subproblems are
+    independent, so with more than one job they are solved by a pool of
+    processes.
+    """
+    base = graph.checkpoint()
+    # any solution that gives all forced students a course is cheaper than
+    # any solution that does not
+    bonus = 1 + int(np.abs(graph.costs).sum())
+    students, _, arcs = graph.match_arcs()
+    has_arcs = np.zeros(graph.num_students, dtype=bool)
+    has_arcs[students[graph.capacities[arcs] > 0]] = True
+    free = np.flatnonzero(
+        has_arcs & (graph.supplies[:graph.num_students] == 0)).tolist()
+
+    pool = None
+    if jobs > 1:
+        pool = ProcessPoolExecutor(max_workers=jobs,
+                                   initializer=_init_worker,
+                                   initargs=(graph, bonus))
+
+    def solve_all(partitions: List[Partition]) -> List[Optional[Solution]]:
+        if pool is not None and len(partitions) > 1:
+            return list(pool.map(_solve_worker_partition, partitions,
+                                 chunksize=max(1, len(partitions) // (
+                                         4 * jobs))))
+        return [solve_partition(graph, base, partition, bonus)
+                for partition in partitions]
+
+    try:
+        solutions = []
+        order = itertools.count()
+        first = solve_all([((), ())])[0]
+        queue = [] if first is None else [
+            (first[0], next(order), ((), ()), first[1])]
+        while queue and len(solutions) < k:
+            cost, _, (forced, excluded), flows = heapq.heappop(queue)
+            solutions.append((cost, flows))
+            if len(solutions) == k:
+                break
+            choices = student_choices(graph, flows)
+            forced_students = {si for si, _ in forced}
+            children = []
+            kept = forced
+            for si in free:
+                if si in forced_students:
+                    continue
+                choice = (si, int(choices[si]))
+                children.append((kept, excluded + (choice,)))
+                kept = kept + (choice,)
+            for child, solution in zip(children, solve_all(children)):
+                if solution is not None:
+                    heapq.heappush(
+                        queue, (solution[0], next(order), child, solution[1]))
+        return solutions
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def student_choices(graph: min_cost_flow.MatchingGraph,
+                    flows: np.ndarray) -> np.ndarray:
+    """ Course index of every student in `flows`, -1 if unassigned """
+    choices = np.full(graph.num_students, -1)
+    students, courses, arcs = graph.match_arcs()
+    used = flows[arcs] > 0
+    choices[students[used]] = courses[used]
+    return choices
+
+
+def solve_partition(graph: min_cost_flow.MatchingGraph, base: dict,
+                    partition: Partition, bonus: int) -> Optional[Solution]:
+    """
+    Solves `graph` restricted to the partition and restores it to `base`.
+    Choices are removed by taking the capacity of their student -> course
+    arcs, and a student who must get a course has `bonus` taken off the cost
+    of their source arc (which is arc `si`).
+    Returns `None` if the partition has no matching.
+    """
+    forced, excluded = partition
+    assigned = []
+    for si, ci in forced:
+        if ci == -1:
+            graph.remove_student(si)
+        else:
+            arcs = graph.student_arcs(si)
+            keep = graph.pair_arcs[graph.pairs.find(si, ci)]
+            graph.set_arc_capacities(arcs[arcs != keep], 0)
+            assigned.append(si)
+    for si, ci in excluded:
+        if ci == -1:
+            assigned.append(si)
+        else:
+            graph.set_arc_capacities(
+                [graph.pair_arcs[graph.pairs.find(si, ci)]], 0)
+    graph.set_arc_costs(assigned, graph.costs[assigned] - bonus)
+    solved = graph.solve()
+    flows = graph.arc_flows()
+    graph.restore(base)
+    if not solved or (flows[assigned] == 0).any():
+        return None
+    return int(base['costs'] @ flows), flows
+
+
+def _init_worker(graph: min_cost_flow.MatchingGraph, bonus: int):
+    global _worker_state
+    _worker_state = graph, graph.checkpoint(), bonus
+
+
+def _solve_worker_partition(partition: Partition) -> Optional[Solution]:
+    graph, base, bonus = _worker_state
+    return solve_partition(graph, base, partition, bonus)
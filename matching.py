@@ -1,27 +1,25 @@
 import argparse
-import copy
 import csv
-import math
 import os
 import sys
 from collections import defaultdict
-from typing import Any, List, Tuple, Optional, DefaultDict, Dict
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from typing import List, Tuple, Optional, DefaultDict, Dict
 
 import numpy as np
 import pandas as pd
 
+import instance_cache
 import interviews
+import k_best
 import min_cost_flow
+import parametric
 import params
-
-
-def __is_nan(num: Any) -> bool:
-    if type(num) == tuple:
-        return False
-    if type(num) == str:
-        return num == 'nan'
-    return math.isnan(num) or pd.isna(num)
-
+import residual_graph
+import trial_store
+from edge_weights import EdgeWeights
+from ranks import RankedFrame, Ranks, rank_codes
 
 student_data_cols = ['Name', 'Weight', 'Year', 'Bank', 'Join', 'Previous',
                      'Advisors', 'Notes']
@@ -34,73 +32,121 @@ ChangeDetails = List[Tuple[str, str, str]]
 
 def match_weights(student_data: pd.DataFrame, course_data: pd.DataFrame,
                   adjusted_path: str, default_value: float = np.nan,
-                  ignore_instructor_prefs=False) -> np.ndarray:
-    def get_rank(rank, is_instructor: bool) -> Tuple[str, int]:
-        if (ignore_instructor_prefs and is_instructor) or __is_nan(rank):
-            return np.nan, 0
-        return rank
-
-    weights = np.full(
-        (len(student_data.index), len(student_data.index)), default_value)
-    for si, (student, s_data) in enumerate(student_data.iterrows()):
-        previous = s_data['Previous'].split(';')
-        advisors = s_data['Advisors'].split(';')
-        for ci, (course, c_data) in enumerate(course_data.iterrows()):
-            instructors = c_data['Instructor'].split(';')
-            c_rank = get_rank(c_data[student], True)
-            s_rank = get_rank(s_data[course], False)
-            if c_rank[0] != 'Veto' and course in s_data and not __is_nan(
-                    s_rank[0]):
-                weights[si, ci] = calculate_weight_per_pairing(
-                    course, s_rank, c_rank, instructors, advisors,
-                    previous, s_data['Ranked'], c_data['Favorites'])
+                  ignore_instructor_prefs=False,
+                  default_pairs: Optional[np.ndarray] = None) -> EdgeWeights:
+    """
+    Returns the weights of the admissible (student, course) pairs. If
+    `default_value` is not NaN, every other pair, or only those set in the
+    (students, courses) mask `default_pairs`, is admissible with that weight.
+    """
+    shape = (len(student_data.index), len(course_data.index))
+    s_ranks, s_places = student_data.ranks.matrices(course_data.index)
+    if ignore_instructor_prefs:
+        c_ranks, c_places = np.zeros(shape, dtype=np.int8), np.zeros(
+            shape, dtype=np.int64)
+    else:
+        c_ranks, c_places = (matrix.T for matrix in
+                             course_data.ranks.matrices(student_data.index))
+    previous = count_names(student_data['Previous'], course_data.index) > 0
+    instructors = course_data['Instructor'].str.split(';').explode()
+    names = pd.Index(pd.unique(instructors.to_numpy()))
+    advisors = count_names(student_data['Advisors'], names) @ (
+            count_names(course_data['Instructor'], names) > 0).T
+
+    admissible = (c_ranks != rank_codes['Veto']) & (s_ranks != 0)
+    students, courses = np.nonzero(admissible)
+    values = calculate_pair_weights(
+        s_ranks[students, courses], s_places[students, courses],
+        c_ranks[students, courses], c_places[students, courses],
+        previous[students, courses], advisors[students, courses],
+        student_data['Ranked'].to_numpy(dtype=np.int64)[students],
+        course_data['Favorites'].to_numpy(dtype=np.int64)[courses])
+    if not np.isnan(default_value):
+        others = np.ones(shape, dtype=bool) if default_pairs is None else \
+            default_pairs.copy()
+        others[students, courses] = False
+        other_students, other_courses = np.nonzero(others)
+        students = np.concatenate([students, other_students])
+        courses = np.concatenate([courses, other_courses])
+        values = np.concatenate(
+            [values, np.full(len(other_students), default_value)])
+    weights = EdgeWeights(students, courses, values, shape)
     make_manual_adjustments(adjusted_path, student_data, course_data, weights)
     return weights
 
 
-def calculate_weight_per_pairing(course: str, s_rank: Tuple[str, int],
-                                 c_rank: Tuple[str, int],
-                                 instructors: List[str], advisors: List[str],
-                                 previous: List[str], s_ranked: int,
-                                 c_favorites: int) -> float:
-    weight = (params.BOOST_PER_COURSE_STUDENT_RANKED * s_ranked) + (
-            params.BOOST_PER_FAVORITE_STUDENT * c_favorites)
-    c_sorted_boost = c_rank[1] * params.BOOST_PER_PLACE_IN_SORTED_COURSE_LIST
-    s_sorted_boost = s_rank[1] * params.BOOST_PER_PLACE_IN_SORTED_STUDENT_LIST
-    if s_rank[0] == 'Favorite':
-        weight += params.BOOST_PER_COURSE_STUDENT_RANKED * s_ranked
-        if c_rank[0] == 'Favorite':
-            weight += params.FAVORITE_FAVORITE + c_sorted_boost + s_sorted_boost
-        else:
-            weight += params.STUDENT_FAVORITE_INSTRUCTOR_NEUTRAL + s_sorted_boost
-    elif s_rank[0] == 'Good' and c_rank[0] == 'Favorite':
-        weight += params.STUDENT_GOOD_INSTRUCTOR_FAVORITE + c_sorted_boost
-    elif s_rank[0] == 'Okay':
-        weight += params.OKAY_COURSE_PENALTY
-
-    if course in previous:
-        weight += params.PREVIOUS
-    for advisor in advisors:
-        if advisor in instructors:
-            weight += params.ADVISORS
-    return weight
+def count_names(lists: pd.Series, names: pd.Index) -> np.ndarray:
+    """ Returns how many times each of `names` is in each ';' separated
+    list of `lists`, one row per list """
+    entries = lists.reset_index(drop=True).str.split(';').explode()
+    cols = names.get_indexer(entries.to_numpy())
+    counts = np.zeros((len(lists), len(names)), dtype=np.int64)
+    np.add.at(counts, (entries.index.to_numpy()[cols >= 0], cols[cols >= 0]),
+              1)
+    return counts
 
 
-def read_student_data(filename: str) -> pd.DataFrame:
+def calculate_pair_weights(s_ranks: np.ndarray, s_places: np.ndarray,
+                           c_ranks: np.ndarray, c_places: np.ndarray,
+                           previous: np.ndarray, advisors: np.ndarray,
+                           s_ranked: np.ndarray,
+                           c_favorites: np.ndarray) -> np.ndarray:
+    """
+    Weights of (student, course) pairs from their rank codes and places, if
+    the student previously TAed the course, how many of the student's
+    advisors teach it, the number of courses the student ranked and the
+    number of students the course favorited. The terms are added in the same
+    order for every pair, so the weights do not depend on how pairs are
+    grouped.
+    """
+    weight = (params.BOOST_PER_COURSE_STUDENT_RANKED * s_ranked) + (
+            params.BOOST_PER_FAVORITE_STUDENT * c_favorites)
+    c_sorted_boost = c_places * params.BOOST_PER_PLACE_IN_SORTED_COURSE_LIST
+    s_sorted_boost = s_places * params.BOOST_PER_PLACE_IN_SORTED_STUDENT_LIST
+    s_favorite = s_ranks == rank_codes['Favorite']
+    c_favorite = c_ranks == rank_codes['Favorite']
+    weight = np.where(
+        s_favorite, weight + params.BOOST_PER_COURSE_STUDENT_RANKED * s_ranked,
+        weight)
+    weight = np.where(
+        s_favorite & c_favorite,
+        weight + (params.FAVORITE_FAVORITE + c_sorted_boost + s_sorted_boost),
+        weight)
+    weight = np.where(
+        s_favorite & ~c_favorite,
+        weight + (params.STUDENT_FAVORITE_INSTRUCTOR_NEUTRAL + s_sorted_boost),
+        weight)
+    weight = np.where(
+        (s_ranks == rank_codes['Good']) & c_favorite,
+        weight + (params.STUDENT_GOOD_INSTRUCTOR_FAVORITE + c_sorted_boost),
+        weight)
+    weight = np.where(
+        s_ranks == rank_codes['Okay'], weight + params.OKAY_COURSE_PENALTY,
+        weight)
+
+    weight = np.where(previous, weight + params.PREVIOUS, weight)
+    # one addition per advisor, like adding the boosts one at a time
+    for count in range(int(advisors.max(initial=0))):
+        weight = np.where(advisors > count, weight + params.ADVISORS, weight)
+    return weight.astype(np.float64)
+
+
+def read_student_data(filename: str) -> RankedFrame:
     """
     Returns a dataframe with rows indexed by NetIDs and columns specified by
-    `student_data_cols` _and_ every course (with the corresponding values being
-    `Okay`, `Good`, `Favorite`, or `NaN` (if no value was specified). Also,
-    there is the field 'Ranked' that is the # of `Favorite` and `Good` courses
-    enumerated by each student.
+    `student_data_cols`, and the field 'Ranked' that is the # of `Favorite` and
+    `Good` courses enumerated by each student. The `Okay`, `Good` or `Favorite`
+    rank and sorted place each student gives to each course are kept in the
+    `ranks` of the dataframe.
     """
-    rank_rows = []
+    netids, columns = [], {col: [] for col in student_data_cols + ['Ranked']}
+    rank_rows, rank_courses, rank_names, rank_places = [], [], [], []
     with open(filename, newline='') as file:
         reader = csv.DictReader(file)
         for row in reader:
-            collect = {col: row[col] for col in student_data_cols}
-            # expand list of courses into ranking for each course
-            collect['Ranked'] = 0
+            for col in student_data_cols:
+                columns[col].append(row[col])
+            ranked = 0
 
             sorted_favs = row.get('Sorted Favorites', '').split('>')
             leveled_favs = {}
@@ -114,15 +160,21 @@ def read_student_data(filename: str) -> pd.DataFrame:
                     filter(
                         lambda x: True if x else False, row[rank].split(';')))
                 if rank == 'Favorite' or rank == 'Good':
-                    collect['Ranked'] += len(courses_in_rank)
+                    ranked += len(courses_in_rank)
                 for i, course in enumerate(courses_in_rank):
                     sorted_score = 0  # implies in no order
                     if rank == 'Favorite':
                         sorted_score = leveled_favs.get(course, 0)
-                    collect[course] = (rank, sorted_score)
-            rank_rows.append(pd.Series(collect, name=row['NetID']))
-
-    df = pd.concat(rank_rows, axis='columns').T
+                    rank_rows.append(len(netids))
+                    rank_courses.append(course)
+                    rank_names.append(rank)
+                    rank_places.append(sorted_score)
+            columns['Ranked'].append(ranked)
+            netids.append(row['NetID'])
+
+    df = RankedFrame(columns, index=pd.Index(netids, dtype=object))
+    df.ranks = Ranks.from_lists(
+        df.index, rank_rows, rank_courses, rank_names, rank_places)
     df['Bank'] = pd.to_numeric(df['Bank'], errors='coerce', downcast='float')
     df['Join'] = pd.to_numeric(df['Join'], errors='coerce', downcast='float')
     df['Weight'] = pd.to_numeric(
@@ -137,33 +189,43 @@ def read_student_data(filename: str) -> pd.DataFrame:
     return df
 
 
-def read_course_data(filename: str) -> pd.DataFrame:
+def read_course_data(filename: str) -> RankedFrame:
     """
     Returns a dataframe with rows indexed by course names and columns specified
-    by `course_data_cols` _and_ every student (with the corresponding values being
-    being `Veto`, `Favorite`, or `NaN` (if no value was specified).
+    by `course_data_cols`, the field 'Favorites' that is the # of students
+    favorited by each course, and the optional ';' separated 'Area' field. The
+    `Veto` or `Favorite` rank and sorted place each course gives to each
+    student are kept in the `ranks` of the dataframe.
     """
-    rank_rows = []
+    courses, columns = [], {
+        col: [] for col in course_data_cols + ['Favorites', 'Area']}
+    rank_rows, rank_students, rank_names, rank_places = [], [], [], []
     with open(filename, newline='') as file:
         reader = csv.DictReader(file)
         for row in reader:
-            collect = {col: row[col] for col in course_data_cols}
-            # expand list of students into ranking for each student
+            for col in course_data_cols:
+                columns[col].append(row[col])
+            columns['Area'].append(row.get('Area') or '')
             for rank in course_options:
                 courses_in_rank = list(
                     filter(
                         lambda x: True if x and not x.isspace() else False,
                         row[rank].split(';')))
                 if rank == 'Favorite':
-                    collect['Favorites'] = len(courses_in_rank)
+                    columns['Favorites'].append(len(courses_in_rank))
                 for i, student in enumerate(courses_in_rank):
                     sorted_score = 0  # implies in no order
                     if rank == 'Favorite' and row.get('Favorites Sorted'):
                         sorted_score = len(courses_in_rank) - i  # positive
-                    collect[student] = (rank, sorted_score)
-            rank_rows.append(pd.Series(collect, name=row['Course']))
-
-    df = pd.concat(rank_rows, axis='columns').T
+                    rank_rows.append(len(courses))
+                    rank_students.append(student)
+                    rank_names.append(rank)
+                    rank_places.append(sorted_score)
+            courses.append(row['Course'])
+
+    df = RankedFrame(columns, index=pd.Index(courses, dtype=object))
+    df.ranks = Ranks.from_lists(
+        df.index, rank_rows, rank_students, rank_names, rank_places)
     df['Slots'] = pd.to_numeric(
         df['Slots'], errors='coerce', downcast='integer').fillna(1)
     df['First weight'] = params.DEFAULT_FIRST_FILL
@@ -191,23 +253,24 @@ def matching_differences(extra_course: Optional[str],
     student_diffs = df_s.iloc[:, 0].compare(df_s.iloc[:, 1]).astype(int)
     course_diffs, student_changes = get_matching_changes(
         student_data, course_data, student_diffs, extra_course)
-    course_changes = parse_course_changes(course_data, course_diffs)
+    course_changes = parse_course_changes(
+        student_data, course_data, course_diffs)
     student_changes.sort(key=lambda x: x[0])
     course_changes.sort(key=lambda x: x[0])
     return student_changes, course_changes
 
 
-def parse_course_changes(course_data: pd.DataFrame,
+def parse_course_changes(student_data: pd.DataFrame, course_data: RankedFrame,
                          course_diffs: pd.DataFrame) -> ChangeDetails:
     course_changes = []
     for _, row in course_diffs.iterrows():
         students_old = str(row[0]).split(';')
         students_new = str(row[1]).split(';')
         for old, new in zip(students_old, students_new):
-            if old in course_data.columns:
-                old += ' ({})'.format(course_data.loc[row.name, old])
-            if new in course_data.columns:
-                new += ' ({})'.format(course_data.loc[row.name, new])
+            if old in student_data.index:
+                old += ' ({})'.format(course_data.ranks.rank(row.name, old))
+            if new in student_data.index:
+                new += ' ({})'.format(course_data.ranks.rank(row.name, new))
             course_changes.append((str(row.name), old, new))
     return course_changes
 
@@ -234,7 +297,7 @@ def get_matching_changes(student_data: pd.DataFrame, course_data: pd.DataFrame,
     return course_diffs, student_changes
 
 
-def parse_student_changes(student_data: pd.DataFrame, course_data: pd.DataFrame,
+def parse_student_changes(student_data: RankedFrame, course_data: pd.DataFrame,
                           student_diffs: pd.DataFrame,
                           course_matches_new: DefaultDict,
                           course_matches_old: DefaultDict) -> ChangeDetails:
@@ -245,10 +308,12 @@ def parse_student_changes(student_data: pd.DataFrame, course_data: pd.DataFrame,
         course_new = course_data.index[row[1]] if row[1] >= 0 else 'unassigned'
         if row[0] >= 0:
             course_matches_old[course_old].append(student)
-            course_old += ' ({})'.format(student_data.loc[student, course_old])
+            course_old += ' ({})'.format(
+                student_data.ranks.rank(student, course_old))
         if row[1] >= 0:
             course_matches_new[course_new].append(student)
-            course_new += ' ({})'.format(student_data.loc[student, course_new])
+            course_new += ' ({})'.format(
+                student_data.ranks.rank(student, course_new))
 
         student_changes.append((student, course_old, course_new))
     return student_changes
@@ -259,28 +324,112 @@ def single_line(changes: ChangeDetails) -> str:
         ['{}: {} -> {}'.format(agent, old, new) for agent, old, new in changes])
 
 
+def build_graph(weights: EdgeWeights, student_data: pd.DataFrame,
+                course_data: pd.DataFrame,
+                fixed_matches: pd.DataFrame) -> min_cost_flow.MatchingGraph:
+    return min_cost_flow.MatchingGraph(
+        weights, student_data['Weight'],
+        course_data[['Slots', 'Base weight', 'First weight']], fixed_matches)
+
+
+# what a what-if scenario solve needs besides the scenario: student data,
+# course data, weights, fixed matches, the initial matches and their weight
+ScenarioContext = Tuple[pd.DataFrame, pd.DataFrame, EdgeWeights, pd.DataFrame,
+                        List[Tuple[int, int]], float]
+# name and arguments of the `MatchingGraph` edit, the number of course slots
+# after the edit, and the course given an extra TA if any
+Scenario = Tuple[str, tuple, int, Optional[str]]
+
+# graph, its unedited checkpoint and the context of a scenario worker process
+_worker_state = None
+
+
+def solve_scenarios(scenarios: List[Scenario], context: ScenarioContext,
+                    jobs=1, graph: min_cost_flow.MatchingGraph = None) -> \
+        List[Tuple[float, str, str]]:
+    """
+    Returns the changes of each scenario (see `calculate_changes_in_new_graph`)
+    in the order of `scenarios`. With more than one job, the scenarios are
+    solved by a pool of processes that each build their own graph, otherwise
+    by editing and restoring `graph` (which must be built from `context`).
+    """
+    if jobs > 1 and len(scenarios) > 1:
+        with ProcessPoolExecutor(
+                max_workers=min(jobs, len(scenarios)),
+                initializer=_init_scenario_worker,
+                initargs=(context, dict(min_cost_flow.graph_options),
+                          params.PREVIOUS_MATCHING_BOOST)) as pool:
+            return list(pool.map(_solve_worker_scenario, scenarios))
+    if graph is None:
+        student_data, course_data, weights, fixed_matches = context[:4]
+        graph = build_graph(weights, student_data, course_data, fixed_matches)
+    base_graph = graph.checkpoint()
+    return [solve_scenario(graph, base_graph, context, scenario,
+                           params.PREVIOUS_MATCHING_BOOST)
+            for scenario in scenarios]
+
+
+def solve_scenario(graph: min_cost_flow.MatchingGraph, base_graph: dict,
+                   context: ScenarioContext, scenario: Scenario,
+                   weight_added_per_change: float) -> Tuple[float, str, str]:
+    """ Applies the scenario edit to `graph`, solves it and restores it """
+    student_data, course_data, weights, fixed_matches, initial_matches, \
+        initial_matching_weight = context
+    edit, edit_args, course_slots, extra_course = scenario
+    getattr(graph, edit)(*edit_args)
+    changes = calculate_changes_in_new_graph(
+        student_data, course_data, initial_matches, weights, fixed_matches,
+        initial_matching_weight, course_slots, weight_added_per_change,
+        extra_course, graph)
+    graph.restore(base_graph)
+    return changes
+
+
+def _init_scenario_worker(context: ScenarioContext, graph_options: dict,
+                          previous_matching_boost: float):
+    global _worker_state
+    min_cost_flow.configure(**graph_options)
+    student_data, course_data, weights, fixed_matches = context[:4]
+    graph = build_graph(weights, student_data, course_data, fixed_matches)
+    _worker_state = graph, graph.checkpoint(), context, previous_matching_boost
+
+
+def _solve_worker_scenario(scenario: Scenario) -> Tuple[float, str, str]:
+    return solve_scenario(*_worker_state[:3], scenario, _worker_state[3])
+
+
 def test_additional_TA(path: str, student_data: pd.DataFrame,
-                       course_data: pd.DataFrame, weights: np.ndarray,
+                       course_data: pd.DataFrame, weights: EdgeWeights,
                        fixed_matches: pd.DataFrame,
                        initial_matches: List[Tuple[int, int]],
-                       initial_matching_weight: float):
+                       initial_matching_weight: float, jobs=1):
     data = {}
     course_slots = course_data['Slots'].sum()
+    graph = build_graph(weights, student_data, course_data, fixed_matches)
+    new_matchings = {}
+    if graph.solve():
+        # filling a slot only changes supplies if the course does not grow
+        new_matchings = residual_graph.ResidualGraph(graph).fill_slot(
+            np.flatnonzero(graph.fixed_counts < graph.slot_counts).tolist())
+    scenarios = []
     for ci, course in enumerate(course_data.index):
         fixed_matches_in_course = (fixed_matches['Course index'] == ci).sum()
         if fixed_matches_in_course == course_data.loc[course, 'Slots']:
             data[course] = -100, "", ""
-            continue
-        # fill one additional course slot
-        fixed_edit = pd.concat(
-            [fixed_matches.T, pd.Series(
-                [np.nan, course, -1, ci],
-                index=['Student', 'Course', 'Student index', 'Course index'])],
-            axis=1).T
-        data[course] = calculate_changes_in_new_graph(
-            student_data, course_data, initial_matches, weights, fixed_edit,
-            initial_matching_weight, course_slots,
-            params.PREVIOUS_MATCHING_BOOST, course)
+        elif ci in new_matchings:
+            data[course] = calculate_changes_from_matching(
+                student_data, course_data, initial_matches,
+                new_matchings[ci], initial_matching_weight, course_slots,
+                params.PREVIOUS_MATCHING_BOOST, course)
+        else:
+            # fill one additional course slot
+            data[course] = None
+            scenarios.append(('fill_slot', (ci,), course_slots, course))
+    context = (student_data, course_data, weights, fixed_matches,
+               initial_matches, initial_matching_weight)
+    for scenario, changes in zip(
+            scenarios, solve_scenarios(scenarios, context, jobs, graph)):
+        data[scenario[3]] = changes
     write_edited_graph_changes(
         path, data, ['Course', 'Weight change', 'Student differences',
                      'Course differences'])
@@ -301,16 +450,17 @@ def write_edited_graph_changes(path: str, change_data: Dict[str, Tuple],
 def calculate_changes_in_new_graph(student_data: pd.DataFrame,
                                    course_data: pd.DataFrame,
                                    initial_matches: List[Tuple[int, int]],
-                                   weights: np.ndarray,
+                                   weights: EdgeWeights,
                                    fixed_matches: pd.DataFrame,
                                    old_weight: float,
                                    course_slots: int,
                                    weight_added_per_change: float,
-                                   extra_course: str = None) -> Tuple[
-    float, str, str]:
+                                   extra_course: str = None,
+                                   graph: min_cost_flow.MatchingGraph = None) -> \
+        Tuple[float, str, str]:
     changes = make_changes_and_calculate_differences(
         student_data, course_data, initial_matches, weights, fixed_matches,
-        extra_course)
+        extra_course, graph)
     if not changes:
         return -100, '', ''
 
@@ -321,18 +471,43 @@ def calculate_changes_in_new_graph(student_data: pd.DataFrame,
     return w_change, single_line(student_changes), single_line(course_changes)
 
 
+def calculate_changes_from_matching(student_data: pd.DataFrame,
+                                    course_data: pd.DataFrame,
+                                    initial_matches: List[Tuple[int, int]],
+                                    new_matching: residual_graph.NewMatching,
+                                    old_weight: float, course_slots: int,
+                                    weight_added_per_change: float,
+                                    extra_course: str = None) -> Tuple[
+    float, str, str]:
+    """ Like `calculate_changes_in_new_graph` for an already known matching """
+    if not new_matching:
+        return -100, '', ''
+
+    new_matches, new_weight = new_matching
+    student_changes, course_changes = matching_differences(
+        extra_course, initial_matches, new_matches, student_data, course_data)
+    w_change = weight_diff(
+        course_slots, old_weight, new_weight, len(student_changes),
+        weight_added_per_change)
+    return w_change, single_line(student_changes), single_line(course_changes)
+
+
 def make_changes_and_calculate_differences(student_data: pd.DataFrame,
                                            course_data: pd.DataFrame,
                                            initial_matches: List[
                                                Tuple[int, int]],
-                                           weights: np.ndarray,
+                                           weights: EdgeWeights,
                                            fixed_matches: pd.DataFrame,
-                                           extra_course: str = None) -> \
+                                           extra_course: str = None,
+                                           graph: min_cost_flow.MatchingGraph = None) -> \
         Optional[Tuple[ChangeDetails, ChangeDetails, float]]:
-    """ Only returns `None` if the graph could not be solved. """
-    graph = min_cost_flow.MatchingGraph(
-        weights, student_data['Weight'],
-        course_data[['Slots', 'Base weight', 'First weight']], fixed_matches)
+    """
+    Solves `graph` if given (which must already reflect the changes),
+    otherwise a new graph. Only returns `None` if the graph could not be
+    solved.
+    """
+    if graph is None:
+        graph = build_graph(weights, student_data, course_data, fixed_matches)
 
     if not graph.solve():
         return None
@@ -343,10 +518,10 @@ def make_changes_and_calculate_differences(student_data: pd.DataFrame,
 
 
 def test_removing_TA(path: str, student_data: pd.DataFrame,
-                     course_data: pd.DataFrame, weights: np.ndarray,
+                     course_data: pd.DataFrame, weights: EdgeWeights,
                      fixed_matches: pd.DataFrame,
                      initial_matches: List[Tuple[int, int]],
-                     initial_matching_weight: float):
+                     initial_matching_weight: float, jobs=1):
     student_indices_in_fixed_matches = fixed_matches['Student index'].values
     matched_students_indices = set()
     for si, ci in initial_matches:
@@ -355,23 +530,36 @@ def test_removing_TA(path: str, student_data: pd.DataFrame,
 
     data = {}
     course_slots = course_data['Slots'].sum()
+    graph = build_graph(weights, student_data, course_data, fixed_matches)
+    new_matchings = {}
+    if graph.solve():
+        new_matchings = residual_graph.ResidualGraph(graph).remove_student(
+            [si for si in sorted(matched_students_indices) if
+             si not in student_indices_in_fixed_matches])
+    scenarios, scenario_students = [], []
     for si, student in enumerate(student_data.index):
         bank = str(student_data.loc[student, 'Bank']).replace('nan', '')
         join = str(student_data.loc[student, 'Join']).replace('nan', '')
         if si not in matched_students_indices:
             data[student] = -100, bank, join, "", ""
-        elif si not in student_indices_in_fixed_matches:
-            # no edges from student node
-            fixed_edit = pd.concat(
-                [fixed_matches.T, pd.Series(
-                    [student, '', si, -1],
-                    index=['Student', 'Course', 'Student index',
-                           'Course index'])], axis=1).T
-            weight_change, s_changes, c_changes = calculate_changes_in_new_graph(
-                student_data, course_data, initial_matches, weights, fixed_edit,
+        elif si in new_matchings:
+            weight_change, s_changes, c_changes = calculate_changes_from_matching(
+                student_data, course_data, initial_matches, new_matchings[si],
                 initial_matching_weight, course_slots,
-                params.PREVIOUS_MATCHING_BOOST, None)
+                params.PREVIOUS_MATCHING_BOOST)
             data[student] = weight_change, bank, join, s_changes, c_changes
+        elif si not in student_indices_in_fixed_matches:
+            # no edges from student node
+            data[student] = bank, join
+            scenarios.append(('remove_student', (si,), course_slots, None))
+            scenario_students.append(student)
+    context = (student_data, course_data, weights, fixed_matches,
+               initial_matches, initial_matching_weight)
+    for student, (weight_change, s_changes, c_changes) in zip(
+            scenario_students,
+            solve_scenarios(scenarios, context, jobs, graph)):
+        bank, join = data[student]
+        data[student] = weight_change, bank, join, s_changes, c_changes
 
     write_edited_graph_changes(
         path, data,
@@ -382,51 +570,66 @@ def test_removing_TA(path: str, student_data: pd.DataFrame,
 def test_adding_or_subtracting_a_slot(path: str, add: bool,
                                       student_data: pd.DataFrame,
                                       course_data: pd.DataFrame,
-                                      weights: np.ndarray,
+                                      weights: EdgeWeights,
                                       fixed_matches: pd.DataFrame,
                                       initial_matches: List[Tuple[int, int]],
-                                      initial_match_weight: float):
+                                      initial_match_weight: float, jobs=1):
     """ if `add == True`, add a slot, otherwise subtract a slot """
-    data = {}
     s_d = (2 * add) - 1
     total_course_slots = course_data['Slots'].sum()
-    for ci, course in enumerate(course_data.index):
-        course_data.at[course, 'Slots'] = course_data.loc[course, 'Slots'] + s_d
-        data[course] = calculate_changes_in_new_graph(
-            student_data, course_data, initial_matches, weights, fixed_matches,
-            initial_match_weight, total_course_slots + s_d,
-            params.PREVIOUS_MATCHING_BOOST, None)
-        course_data.at[course, 'Slots'] = course_data.loc[course, 'Slots'] - s_d
+    scenarios = [
+        ('set_course_slots', (ci, course_data.loc[course, 'Slots'] + s_d),
+         total_course_slots + s_d, None)
+        for ci, course in enumerate(course_data.index)]
+    context = (student_data, course_data, weights, fixed_matches,
+               initial_matches, initial_match_weight)
+    data = dict(zip(course_data.index,
+                    solve_scenarios(scenarios, context, jobs)))
     write_edited_graph_changes(
         path, data, ['Course', 'Weight change', 'Student differences',
                      'Course differences'])
 
 
 def find_alternate_matching(path: str, student_data: pd.DataFrame,
-                            course_data: pd.DataFrame, weights: np.ndarray,
+                            course_data: pd.DataFrame, weights: EdgeWeights,
                             fixed_matches: pd.DataFrame,
                             initial_matches: List[Tuple[int, int]],
                             last_matches: List[Tuple[int, int]],
-                            cumulative: float, step=0.005) -> Tuple[
-    List[Tuple[int, int]], float, float]:
-    while True:
-        for si, ci in initial_matches:
-            if ci >= 0:
-                weights[si, ci] -= step
-        cumulative += step
-        graph_edit = min_cost_flow.MatchingGraph(
-            weights, student_data['Weight'],
-            course_data[['Slots', 'Base weight', 'First weight']],
-            fixed_matches)
-        if graph_edit.solve():
-            new_matches = graph_edit.get_matching(fixed_matches, weights)
-            student_changes, course_changes = matching_differences(
-                None, last_matches, new_matches, student_data, course_data)
-            if len(student_changes) > 0 or len(course_changes) > 0:
-                new_weight = write_alternate_match(
-                    path, student_data, course_data, initial_matches,
-                    graph_edit.graph_weight(), new_matches, cumulative)
-                return new_matches, cumulative, new_weight
+                            cumulative: Fraction,
+                            graph_edit: min_cost_flow.MatchingGraph) -> \
+        Optional[Tuple[List[Tuple[int, int]], Fraction, float]]:
+    """
+    `graph_edit` must have been built from `weights`, and `last_matches` must
+    be optimal when the initial matches are discounted by `cumulative`.
+    Finds the smallest discount of the initial matches, from `cumulative` up,
+    at which the matching is no longer `last_matches`, exactly, see
+    `parametric.next_breakpoint`. Returns `None` if there is none.
+    """
+    matched = np.array([(si, ci) for si, ci in initial_matches if ci >= 0],
+                       dtype=int).reshape(-1, 2)
+    arcs = graph_edit.pair_arcs[
+        graph_edit.pairs.find(matched[:, 0], matched[:, 1])]
+    arcs = arcs[arcs >= 0]
+    base_costs = graph_edit.costs.copy()
+    line = parametric.solve_discounted(
+        graph_edit, base_costs, arcs, cumulative)
+    while line is not None:
+        new_matches = graph_edit.get_matching(fixed_matches, weights, line[0])
+        student_changes, course_changes = matching_differences(
+            None, last_matches, new_matches, student_data, course_data)
+        if len(student_changes) > 0 or len(course_changes) > 0:
+            graph_weight = float(-parametric.line_cost(line, cumulative) /
+                                 parametric.COST_UNIT)
+            new_weight = write_alternate_match(
+                path, student_data, course_data, initial_matches,
+                graph_weight, new_matches, float(cumulative))
+            return new_matches, cumulative, new_weight
+        breakpoint = parametric.next_breakpoint(
+            graph_edit, base_costs, arcs, cumulative, line)
+        if breakpoint is None:
+            return None
+        cumulative, line = breakpoint
+    return None
 
 
 def write_alternate_match(path: str, student_data: pd.DataFrame,
@@ -441,6 +644,12 @@ def write_alternate_match(path: str, student_data: pd.DataFrame,
             len(new_matches) - len(student_changes)) * cumulative
     print(
         f'Solved alternate flow (discount: {cumulative:.3f}) with total weight {new_weight:.2f}')
+    write_matching_changes(path, student_changes, course_changes)
+    return new_weight
+
+
+def write_matching_changes(path: str, student_changes: ChangeDetails,
+                           course_changes: ChangeDetails):
     with open(path, 'w', newline='') as file:
         writer = csv.writer(file)
         writer.writerow(
@@ -449,7 +658,6 @@ def write_alternate_match(path: str, student_data: pd.DataFrame,
             writer.writerow([student, old, new])
         for course, old, new in course_changes:
             writer.writerow([course, old, new])
-    return new_weight
 
 
 def write_params(output_path: str):
@@ -465,18 +673,40 @@ def write_params(output_path: str):
 def run_matching(path="", student_data="inputs/student_data.csv",
                  course_data="inputs/course_data.csv", fixed="inputs/fixed.csv",
                  adjusted="inputs/adjusted.csv", previous="inputs/previous.csv",
-                 output="outputs/", alternates=2, run_interviews=False) -> \
+                 output="outputs/", alternates=2, run_interviews=False,
+                 compact_graph=False, backend='ortools',
+                 cache: Optional[str] = None, jobs=1,
+                 alternates_method='discount', seed: Optional[int] = None,
+                 store: Optional[str] = None,
+                 interview_shortlist: Optional[int] = None) -> \
         Tuple[float, int, List[float]]:
+    """
+    If `cache` is a folder, the instance compiled from the inputs is kept
+    there and reused by later runs with the same inputs and params. The
+    what-if analyses solve their scenarios, and the interview simulations
+    their trials, with `jobs` processes. `alternates_method` is the method of
+    `run_alternate_matchings`. `seed` makes the interview simulations
+    reproducible. If `store` is a folder, the counts of the interview
+    trials are kept there, so interrupted or repeated simulations of the same
+    inputs and params reuse them. `interview_shortlist` is the number of
+    students per slot of the shortlist of each course, if one is written.
+    """
     path = validate_path_args(path, output)
-    student_data, course_data = read_student_and_course_data(
-        path, student_data, course_data)
-    weights = match_weights(student_data, course_data, path + adjusted)
-    previous_matches = make_adjustments_from_previous(
-        path + previous, student_data, course_data, weights)
-    fixed_matches = get_fixed_matches(path + fixed, student_data, course_data)
-    graph = min_cost_flow.MatchingGraph(
-        weights, student_data['Weight'],
-        course_data[['Slots', 'Base weight', 'First weight']], fixed_matches)
+    min_cost_flow.configure(compact=compact_graph, backend=backend)
+    input_files = [path + student_data, path + course_data, path + fixed,
+                   path + adjusted, path + previous]
+
+    def compile_instance() -> instance_cache.Instance:
+        return read_instance(*input_files)
+
+    if cache is None:
+        instance = compile_instance()
+    else:
+        instance = instance_cache.load_or_compile(
+            path + cache, input_files, compile_instance)
+    student_data, course_data, weights, fixed_matches, previous_matches = \
+        instance
+    graph = build_graph(weights, student_data, course_data, fixed_matches)
 
     if not graph.solve():
         print('Problem optimizing flow')
@@ -491,43 +721,57 @@ def run_matching(path="", student_data="inputs/student_data.csv",
 
     write_params(output_path)
 
+    stored_trials = None
+    if store is not None:
+        stored_trials = trial_store.TrialStore(
+            path + store, instance_cache.instance_key(input_files))
     alt_weights = run_additional_features(
         output_path, student_data, course_data, weights, fixed_matches,
         initial_matches, matching_weight, path + adjusted, alternates,
-        previous_matches, run_interviews)
+        previous_matches, run_interviews, jobs, alternates_method, seed,
+        stored_trials, interview_shortlist)
 
+    stats = min_cost_flow.solve_cache.stats()
+    print(f'Solve cache: {stats["hits"]} hits, {stats["misses"]} misses')
     return matching_weight, slots_unfilled, alt_weights
 
 
 def run_additional_features(output_path: str, student_data: pd.DataFrame,
-                            course_data: pd.DataFrame, weights: np.ndarray,
+                            course_data: pd.DataFrame, weights: EdgeWeights,
                             fixed_matches: pd.DataFrame,
                             initial_matches: List[Tuple[int, int]],
                             matching_weight: float, adjusted_path: str,
                             alternates: int, previous_matches: pd.DataFrame,
-                            run_interviews=False) -> List[float]:
+                            run_interviews=False, jobs=1,
+                            alternates_method='discount',
+                            seed: Optional[int] = None,
+                            store: Optional[
+                                trial_store.TrialStore] = None,
+                            interview_shortlist: Optional[int] = None) -> \
+        List[float]:
+    initial_pairs = np.array(initial_matches, dtype=int).reshape(-1, 2)
+
     def repopulate_weights(value: float):
-        for si, ci in initial_matches:
-            weights[si, ci] += value
+        weights.add(initial_pairs[:, 0], initial_pairs[:, 1], value)
 
     repopulate_weights(params.PREVIOUS_MATCHING_BOOST)
     test_additional_TA(
         output_path + 'additional_TA.csv', student_data, course_data, weights,
-        fixed_matches, initial_matches, matching_weight)
+        fixed_matches, initial_matches, matching_weight, jobs)
     test_removing_TA(
         output_path + 'remove_TA.csv', student_data, course_data, weights,
-        fixed_matches, initial_matches, matching_weight)
+        fixed_matches, initial_matches, matching_weight, jobs)
     test_adding_or_subtracting_a_slot(
         output_path + 'add_slot.csv', True, student_data, course_data, weights,
-        fixed_matches, initial_matches, matching_weight)
+        fixed_matches, initial_matches, matching_weight, jobs)
     test_adding_or_subtracting_a_slot(
         output_path + 'remove_slot.csv', False, student_data, course_data,
-        weights, fixed_matches, initial_matches, matching_weight)
+        weights, fixed_matches, initial_matches, matching_weight, jobs)
     repopulate_weights(-params.PREVIOUS_MATCHING_BOOST)
 
     alt_weights = run_alternate_matchings(
         output_path, alternates, student_data, course_data, weights,
-        fixed_matches, initial_matches)
+        fixed_matches, initial_matches, alternates_method, jobs)
     if not previous_matches.empty:
         test_changes_from_previous(
             output_path, student_data, course_data, weights, fixed_matches,
@@ -535,7 +779,11 @@ def run_additional_features(output_path: str, student_data: pd.DataFrame,
     if run_interviews:
         interviews.create_interview_list(
             course_data, student_data, fixed_matches, adjusted_path,
-            output_path, initial_matches)
+            output_path, initial_matches, seed, jobs, store=store)
+    if interview_shortlist is not None:
+        interviews.create_interview_shortlist(
+            course_data, student_data, fixed_matches, adjusted_path,
+            output_path, interview_shortlist)
     return alt_weights
 
 
@@ -546,7 +794,7 @@ def weight_diff(course_slots: int, zero_added_weight: float, new_weight: float,
 
 
 def test_changes_from_previous(output_path: str, student_data: pd.DataFrame,
-                               course_data: pd.DataFrame, weights: np.ndarray,
+                               course_data: pd.DataFrame, weights: EdgeWeights,
                                fixed_matches: pd.DataFrame,
                                previous_matches: pd.DataFrame):
     def get_student_and_course_indices(student: pd.Series) -> Tuple[int, int]:
@@ -560,27 +808,49 @@ def test_changes_from_previous(output_path: str, student_data: pd.DataFrame,
         return si, ci
 
     def repopulate_weights(value: float):
-        for _, entry in previous_matches.iterrows():
-            si, ci = get_student_and_course_indices(entry)
-            if si != -1 and ci != -1:
-                weights[si, ci] += value
-
-    def binary_search(desired_matches: int,
-                      initial_matches: List[Tuple[int, int]]) -> Optional[
+        weights.add(previous_pairs[:, 0], previous_pairs[:, 1], value)
+        graph.update_match_weights(
+            weights, previous_pairs[:, 0], previous_pairs[:, 1])
+
+    def changes_with_boost(
+            boost: float, initial_matches: List[Tuple[int, int]]) -> Optional[
+        Tuple[ChangeDetails, ChangeDetails, float]]:
+        repopulate_weights(boost)
+        changes = make_changes_and_calculate_differences(
+            student_data, course_data, initial_matches, weights,
+            fixed_matches, graph=graph)
+        repopulate_weights(-boost)
+        return changes
+
+    def sweep_boosts(lo: float, hi: float, changes_lo: int, changes_hi: int,
+                     initial_matches: List[Tuple[int, int]]):
+        """
+        Solves the bisection midpoints between `lo` and `hi`, which have
+        `changes_lo` and `changes_hi` student changes, that the binary search
+        of any desired number of changes visits. Its interval always has more
+        than the desired changes at `lo` and at most the desired changes at
+        `hi`, so only intervals where the changes drop past a desired number
+        are split.
+        """
+        if hi <= lo + 0.01 or max(1, changes_hi) > min(
+                max_changes - 1, changes_lo - 1):
+            return
+        mid = lo + (hi - lo) / 2
+        changes = changes_with_boost(mid, initial_matches)
+        swept[mid] = changes
+        # a graph that cannot be solved has too many changes for any search
+        changes_mid = len(changes[0]) if changes else max_changes
+        sweep_boosts(lo, mid, changes_lo, changes_mid, initial_matches)
+        sweep_boosts(mid, hi, changes_mid, changes_hi, initial_matches)
+
+    def binary_search(desired_matches: int) -> Optional[
         Tuple[int, ChangeDetails, ChangeDetails, float]]:
-        lo = 0.0
-        hi = 1.0 + params.DEFAULT_ASSIGN + max(
-            -(5.0 - params.DEFAULT_BANK) * params.BANK_MULTIPLIER, (
-                    5.0 - params.DEFAULT_JOIN) * params.JOIN_MULTIPLIER) + params.MSE_BOOST + params.FAVORITE_FAVORITE + params.PREVIOUS + 2.0 * params.ADVISORS + 10.0 * (
-                     params.BOOST_PER_COURSE_STUDENT_RANKED + params.BOOST_PER_FAVORITE_STUDENT + params.BOOST_PER_PLACE_IN_SORTED_COURSE_LIST + params.BOOST_PER_PLACE_IN_SORTED_STUDENT_LIST)
+        """ Bisects the boost over the changes solved by `sweep_boosts` """
+        lo, hi = 0.0, max_boost
         prev_desired = None
         while hi > lo + 0.01:
             mid = lo + (hi - lo) / 2
-            repopulate_weights(mid)
-            changes = make_changes_and_calculate_differences(
-                student_data, course_data, initial_matches, weights,
-                fixed_matches)
-            repopulate_weights(-mid)
+            changes = swept[mid]
             if not changes or len(changes[0]) > desired_matches:
                 lo = mid
             else:
@@ -602,7 +872,7 @@ def test_changes_from_previous(output_path: str, student_data: pd.DataFrame,
         int, float, str, str]:
         changes = make_changes_and_calculate_differences(
             student_data, course_data, indices_for_previous_matches, weights,
-            fixed_matches)
+            fixed_matches, graph=graph)
         if not changes:
             print(f"Graph could not be solved with no added weight")
             return -1, 0.0, "", ""
@@ -612,6 +882,10 @@ def test_changes_from_previous(output_path: str, student_data: pd.DataFrame,
 
     course_slots = course_data['Slots'].sum()
     previous_indices = get_previous_indices()
+    previous_pairs = np.array(
+        [(si, ci) for si, ci in previous_indices if ci != -1],
+        dtype=int).reshape(-1, 2)
+    graph = build_graph(weights, student_data, course_data, fixed_matches)
     changes_with_param_weight, weight_with_param_weight, student_diffs_param_weight, course_diffs_param_weight = get_initial_changes(
         previous_indices)
 
@@ -630,8 +904,16 @@ def test_changes_from_previous(output_path: str, student_data: pd.DataFrame,
          f"{params.PREVIOUS_MATCHING_BOOST} (main matching)", 0.0,
          student_diffs_param_weight, course_diffs_param_weight)]
 
+    # the boost at which every student keeps their previous match
+    max_boost = 1.0 + params.DEFAULT_ASSIGN + max(
+        -(5.0 - params.DEFAULT_BANK) * params.BANK_MULTIPLIER, (
+                5.0 - params.DEFAULT_JOIN) * params.JOIN_MULTIPLIER) + params.MSE_BOOST + params.FAVORITE_FAVORITE + params.PREVIOUS + 2.0 * params.ADVISORS + 10.0 * (
+                        params.BOOST_PER_COURSE_STUDENT_RANKED + params.BOOST_PER_FAVORITE_STUDENT + params.BOOST_PER_PLACE_IN_SORTED_COURSE_LIST + params.BOOST_PER_PLACE_IN_SORTED_STUDENT_LIST)
+    # changes by boost, at every midpoint the binary searches visit
+    swept = {}
+    sweep_boosts(0.0, max_boost, max_changes, 0, previous_indices)
     for i in range(1, max_changes):
-        change = binary_search(i, previous_indices)
+        change = binary_search(i)
         if change:
             weight_added_per_prev_match, student_diffs, course_diffs, new_weight = change
             if len(student_diffs) == i:
@@ -656,30 +938,41 @@ def test_changes_from_previous(output_path: str, student_data: pd.DataFrame,
 
 
 def make_manual_adjustments(path: str, student_data: pd.DataFrame,
-                            course_data: pd.DataFrame, weights: np.ndarray):
+                            course_data: pd.DataFrame, weights: EdgeWeights):
     if not os.path.isfile(path):
         return
     adjusted_matches = pd.read_csv(
         path, dtype={'NetID': str, 'Course': str, 'Weight': float})
-    for _, row in adjusted_matches.iterrows():
-        si = student_data.index.get_loc(row['NetID'])
-        if row['Course'] not in course_data.index:
-            continue
-        ci = course_data.index.get_loc(row['Course'])
-        weights[si, ci] += row['Weight']
+    students = student_data.index.get_indexer(adjusted_matches['NetID'])
+    if (students == -1).any():
+        raise KeyError(adjusted_matches['NetID'][students == -1].iloc[0])
+    courses = course_data.index.get_indexer(adjusted_matches['Course'])
+    known = courses != -1
+    weights.add(students[known], courses[known],
+                adjusted_matches['Weight'].to_numpy()[known])
+
+
+def read_instance(student_data_path: str, course_data_path: str,
+                  fixed_path: str, adjusted_path: str,
+                  previous_path: str) -> instance_cache.Instance:
+    """
+    Returns the student and course data, the match weights with the manual
+    and previous adjustments, the fixed matches and the previous matches
+    """
+    student_data = read_student_data(student_data_path)
+    course_data = read_course_data(course_data_path)
+    weights = match_weights(student_data, course_data, adjusted_path)
+    previous_matches = make_adjustments_from_previous(
+        previous_path, student_data, course_data, weights)
+    fixed_matches = get_fixed_matches(fixed_path, student_data, course_data)
+    return student_data, course_data, weights, fixed_matches, previous_matches
 
 
 def read_student_and_course_data(path: str, student_data_file_name: str,
                                  course_data_file_name: str) -> Tuple[
-    pd.DataFrame, pd.DataFrame]:
+    RankedFrame, RankedFrame]:
     student_data = read_student_data(path + student_data_file_name)
     course_data = read_course_data(path + course_data_file_name)
-    for student in student_data.index:
-        if student not in course_data.columns.values:
-            course_data[student] = np.nan
-    for course in course_data.index:
-        if course not in student_data.columns.values:
-            student_data[course] = np.nan
     return student_data, course_data
 
 
@@ -698,39 +991,77 @@ def get_fixed_matches(path: str, student_data: pd.DataFrame,
 
 def make_adjustments_from_previous(path: str, student_data: pd.DataFrame,
                                    course_data: pd.DataFrame,
-                                   weights: np.ndarray) -> pd.DataFrame:
+                                   weights: EdgeWeights) -> pd.DataFrame:
     if not os.path.isfile(path):
         return pd.DataFrame(columns=['NetID', 'Course'])
     previous_matches = pd.read_csv(
         path, dtype={'NetID': str, 'Course': str})
-    for _, row in previous_matches.iterrows():
-        if not (row['NetID'] in student_data.index and row[
-            'Course'] in course_data.index):
-            continue
-        si = student_data.index.get_loc(row['NetID'])
-        ci = course_data.index.get_loc(row['Course'])
-        weights[si, ci] += params.PREVIOUS_MATCHING_BOOST
+    students = student_data.index.get_indexer(previous_matches['NetID'])
+    courses = course_data.index.get_indexer(previous_matches['Course'])
+    known = (students != -1) & (courses != -1)
+    weights.add(students[known], courses[known],
+                params.PREVIOUS_MATCHING_BOOST)
     return previous_matches
 
 
 def run_alternate_matchings(path: str, alternates: int,
                             student_data: pd.DataFrame,
                             course_data: pd.DataFrame,
-                            initial_weights: np.ndarray,
+                            initial_weights: EdgeWeights,
                             fixed_matches: pd.DataFrame,
-                            best_matches: List[Tuple[int, int]]) -> List[float]:
+                            best_matches: List[Tuple[int, int]],
+                            method='discount', jobs=1) -> List[float]:
+    """
+    With the 'discount' method, each alternate is the matching found by
+    discounting the initial matches just past the point where the matching
+    changes. With the
+    'k_best' method, the alternates are the 2nd to (`alternates` + 1)-th best
+    matchings, see `k_best.k_best_matchings`.
+    """
+    if method == 'k_best':
+        return write_k_best_matchings(
+            path, alternates, student_data, course_data, initial_weights,
+            fixed_matches, best_matches, jobs)
     last_matches = best_matches
-    cumulative = 0.0
+    cumulative = Fraction(0)
     alt_weights = []
-    weights = copy.deepcopy(initial_weights)
+    graph = build_graph(
+        initial_weights, student_data, course_data, fixed_matches)
     for i in range(alternates):
-        last_matches, cumulative, alt_weight = find_alternate_matching(
-            f'{path}alternate{i + 1}.csv', student_data, course_data, weights,
-            fixed_matches, best_matches, last_matches, cumulative)
+        alternate = find_alternate_matching(
+            f'{path}alternate{i + 1}.csv', student_data, course_data,
+            initial_weights, fixed_matches, best_matches, last_matches,
+            cumulative, graph)
+        if alternate is None:
+            print('No discount of the initial matches changes the matching')
+            break
+        last_matches, cumulative, alt_weight = alternate
         alt_weights.append(alt_weight)
     return alt_weights
 
 
+def write_k_best_matchings(path: str, alternates: int,
+                           student_data: pd.DataFrame,
+                           course_data: pd.DataFrame, weights: EdgeWeights,
+                           fixed_matches: pd.DataFrame,
+                           best_matches: List[Tuple[int, int]],
+                           jobs=1) -> List[float]:
+    graph = build_graph(weights, student_data, course_data, fixed_matches)
+    solutions = k_best.k_best_matchings(graph, alternates + 1, jobs)
+    alt_weights = []
+    for i, (cost, flows) in enumerate(solutions[1:]):
+        new_matches = graph.get_matching(fixed_matches, weights, flows)
+        new_weight = -cost / parametric.COST_UNIT
+        print(f'Solved alternate flow ({i + 2}-best) with total weight '
+              f'{new_weight:.2f}')
+        student_changes, course_changes = matching_differences(
+            None, best_matches, new_matches, student_data, course_data)
+        write_matching_changes(
+            f'{path}alternate{i + 1}.csv', student_changes, course_changes)
+        alt_weights.append(new_weight)
+    return alt_weights
+
+
 def validate_path_args(path: str, output: str) -> str:
     # ensure trailing slash on path directory
     if path[-1] != '/':
@@ -772,6 +1103,73 @@ if __name__ == '__main__':
     parser.add_argument(
         '--run_interviews', default=False, action='store_true',
         help='run the interviews simulation')
-    args = parser.parse_args()
-
-    run_matching(**vars(args))
+    parser.add_argument(
+        '--compact_graph', default=False, action='store_true',
+        help='model course slots as parallel arcs instead of slot nodes')
+    parser.add_argument(
+        '--backend', default='ortools',
+        choices=sorted(min_cost_flow.flow_solvers.SOLVERS),
+        help='solver of the matching graph')
+    parser.add_argument(
+        '--cache', metavar='CACHE FOLDER', default=None,
+        help='folder to keep compiled inputs in, to skip reading them again '
+             'on later runs with the same inputs and params')
+    parser.add_argument(
+        '--jobs', metavar='JOBS', type=int, default=1,
+        help='number of processes solving the what-if scenarios, the '
+             'k-best subproblems and the interview trials')
+    parser.add_argument(
+        '--alternates_method', default='discount',
+        choices=['discount', 'k_best'],
+        help='discount the initial matches until the matching changes, or '
+             'take the next best matchings')
+    parser.add_argument(
+        '--seed', metavar='SEED', type=int, default=None,
+        help='seed of the interview simulations, for reproducible results')
+    parser.add_argument(
+        '--interview_shortlist', metavar='N', type=int, default=None,
+        help='write the N students per slot of each course whose forced '
+             'match costs the least, without simulations')
+    parser.add_argument(
+        '--trial_store', metavar='STORE FOLDER', default=None, dest='store',
+        help='folder to keep the counts of the interview trials in, to resume '
+             'or repeat the simulations of the same inputs and params')
+    parser.add_argument(
+        '--interview_noise', default='iid', choices=interviews.NOISE_MODES,
+        help='draw the noise of the interview trials independently, in '
+             'antithetic pairs or from scrambled Sobol\' points')
+    parser.add_argument(
+        '--common_noise', default=False, action='store_true',
+        help='scale the same noise draws for every sigma of the interview '
+             'simulations')
+    parser.add_argument(
+        '--report_variance', default=False, action='store_true',
+        help='print the variance reduction of each interview simulation')
+    parser.add_argument(
+        '--screen_sigmas', metavar='K', type=float, default=None,
+        help='drop the edges of the interview trials whose cheapest way into '
+             'the matching costs more than K standard deviations of noise')
+    parser.add_argument(
+        '--batch_trials', default=False, action='store_true',
+        help='solve the interview trials of a task together, with shortest '
+             'augmenting paths vectorized over the trials')
+    parser.add_argument(
+        '--interview_candidates', default='all',
+        choices=interviews.CANDIDATE_SETS,
+        help='let the interview trials match every pair, only the courses '
+             'each student listed, or those and the courses sharing an area '
+             'with them')
+    parser.add_argument(
+        '--speculative_sigmas', metavar='N', type=int, default=1,
+        help='simulate the sigmas proposed for the next N empty interview '
+             'buckets together')
+    args = vars(parser.parse_args())
+
+    interviews.configure(noise=args.pop('interview_noise'),
+                         common_noise=args.pop('common_noise'),
+                         report_variance=args.pop('report_variance'),
+                         screen_sigmas=args.pop('screen_sigmas'),
+                         batched=args.pop('batch_trials'),
+                         speculative_sigmas=args.pop('speculative_sigmas'),
+                         candidates=args.pop('interview_candidates'))
+    run_matching(**args)
@@ -1,12 +1,89 @@
+import copy
 import csv
-from typing import Tuple, List
+import hashlib
+from collections import OrderedDict
+from typing import Tuple, List, Optional, Dict
 
 import numpy as np
 import pandas as pd
-from ortools.graph import pywrapgraph
+
+import flow_solvers
+from edge_weights import EdgeWeights
 
 DIGITS = 2
 
+# defaults used by every `MatchingGraph`, see `configure`
+graph_options = {'compact': False, 'backend': 'ortools'}
+
+
+def configure(**options):
+    """
+    Sets the default construction options of `MatchingGraph` for the rest of
+    the execution, so the analyses that rebuild graphs pick them up as well.
+    """
+    unknown = set(options) - set(graph_options)
+    if unknown:
+        raise ValueError(f'Unknown graph options {sorted(unknown)}')
+    if options.get('backend', 'ortools') not in flow_solvers.SOLVERS:
+        raise ValueError(f'Unknown backend {options["backend"]}, expected one '
+                         f'of {sorted(flow_solvers.SOLVERS)}')
+    graph_options.update(options)
+
+
+class SolveCache:
+    """
+    Least recently used cache of the flows of solved graphs, keyed by
+    `MatchingGraph.fingerprint`, so a scenario that an earlier analysis
+    already solved (even on another graph built from the same inputs) does not
+    reach the solver again. Graphs that could not be solved are cached too.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # fingerprint -> None, or the arcs with flow and their flows
+        self._entries = OrderedDict()
+
+    def lookup(self, key: bytes) -> Tuple[bool, Optional[np.ndarray]]:
+        """ Returns if the graph was solved before and its flows, if any """
+        if key not in self._entries:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        entry = self._entries[key]
+        if entry is None:
+            return True, None
+        num_arcs, arcs, arc_flows = entry
+        flows = np.zeros(num_arcs, dtype=np.int64)
+        flows[arcs] = arc_flows
+        return True, flows
+
+    def store(self, key: bytes, flows: Optional[np.ndarray]):
+        if self.max_size <= 0:
+            return
+        entry = None
+        if flows is not None:
+            arcs = np.flatnonzero(flows)
+            entry = len(flows), arcs.astype(np.int32), flows[arcs]
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries)}
+
+
+# shared by every `MatchingGraph` of the execution, see `SolveCache`
+solve_cache = SolveCache()
+
 
 def add_to_slots_from_fixed_matches(course_info, fixed_matches):
     pre_filled_slots = {}  # key = course, value = num slots filled
@@ -24,104 +101,373 @@ def fill_value(index: int, base: float, first: float) -> int:
     return int((base + first / (index + 1)) * 10 ** DIGITS)
 
 
+def to_costs(weights: np.ndarray) -> np.ndarray:
+    """ Scales weights to integer costs, truncating toward zero like `int` """
+    return (weights * 10 ** DIGITS).astype(np.int64)
+
+
 class MatchingGraph:
+    """
+    Min cost flow graph of the matching. The arcs are kept as NumPy arrays
+    (`tails`, `heads`, `capacities`, `costs`) and the node supplies as
+    `supplies`, which can be edited in place with the `set_*` and
+    `update_*` methods before solving again. Editing is much cheaper than
+    building a new graph, so analyses that solve many variations of the same
+    matching should reuse one graph and `restore` it after each variation.
 
-    def __init__(self, match_weights: np.ndarray, student_weights, course_info,
-                 fixed_matches):
+    The graph is solved by one of the solvers in `flow_solvers.SOLVERS`, which
+    all return the flow on every arc. Solvers that can warm start keep their
+    state across the solves of the graph.
+    """
+
+    def __init__(self, match_weights: EdgeWeights, student_weights, course_info,
+                 fixed_matches, compact: bool = None, backend: str = None):
+        """
+        If `compact`, each course slot is an arc straight from the course node
+        to the sink instead of a node of its own. The optimal matchings are the
+        same, but the graph has no node per slot. `backend` names the solver,
+        see `configure`.
+        """
         add_to_slots_from_fixed_matches(course_info, fixed_matches)
+        if compact is None:
+            compact = graph_options['compact']
+        if backend is None:
+            backend = graph_options['backend']
+        self.compact = compact
+        self.solver = flow_solvers.SOLVERS[backend]()
+        self.flows = None
+        self.optimal_cost = None
 
         self.num_students = len(student_weights)
         self.num_courses = len(course_info.index)
         self.slots = int(course_info['Slots'].fillna(
             0).replace(r'\s+', 0, regex=True).sum())
-        source, sink = range(
-            self.num_students + self.num_courses + self.slots,
-            2 + self.num_students + self.num_courses + self.slots)
-        self.flow = pywrapgraph.SimpleMinCostFlow(sink + 1)
+        self.slot_counts = course_info['Slots'].to_numpy(dtype=int)
+        self.base_fill = course_info['Base weight'].to_numpy(dtype=np.float64)
+        self.first_fill = course_info['First weight'].to_numpy(
+            dtype=np.float64)
+        self._set_terminals()
+        source, sink = self.source, self.sink
+        supplies = np.zeros(sink + 1, dtype=np.int64)
+        tails, heads, costs = [], [], []
 
         # Each student cannot fill >1 course slot
-        for i, w in enumerate(student_weights):
-            self.flow.AddArcWithCapacityAndUnitCost(
-                source, i, 1, -int(w * 10 ** DIGITS))
+        self.student_costs = to_costs(
+            np.asarray(student_weights, dtype=np.float64))
+        tails.append(np.full(self.num_students, source))
+        heads.append(np.arange(self.num_students))
+        costs.append(-self.student_costs)
 
         # Each course slot cannot have >1 TA
-        node = self.num_students + self.num_courses
-        for i, (_, row) in enumerate(course_info.iterrows()):
-            for s in range(int(row['Slots'])):
-                self.flow.AddArcWithCapacityAndUnitCost(
-                    self.num_students + i, node, 1, -fill_value(
-                        s, row['Base weight'], row['First weight']))
-                self.flow.AddArcWithCapacityAndUnitCost(node, sink, 1, 0)
-                node += 1
+        slot_tails, slot_heads, slot_costs = self._slot_arcs()
+        self._slot_arcs_range = (self.num_students,
+                                 self.num_students + len(slot_tails))
+        tails.append(slot_tails)
+        heads.append(slot_heads)
+        costs.append(slot_costs)
 
         # Force fixed matching edges to be filled
-        missing = 0
-        for _, row in fixed_matches.iterrows():
-            si, ci = row["Student index"], row["Course index"]
-            if si == -1:
-                # self.flow.AddArcWithCapacityAndUnitCost(empty, students + ci, 1, 0)
-                self.flow.SetNodeSupply(
-                    self.num_students + ci, self.flow.Supply(
-                        self.num_students + ci) + 1)
-            elif ci == -1:
-                missing += 1
-            else:
-                match_cost = -int(match_weights[si, ci] * 10 ** DIGITS)
-                # must include weight from incoming edge to student node
-                assign_cost = -int(student_weights[si] * 10 ** DIGITS)
-                self.flow.AddArcWithCapacityAndUnitCost(
-                    si, self.num_students + ci, 1, match_cost + assign_cost)
-                self.flow.SetNodeSupply(si, 1)
+        fixed_si = fixed_matches['Student index'].to_numpy(dtype=int)
+        fixed_ci = fixed_matches['Course index'].to_numpy(dtype=int)
+        empty = fixed_si == -1
+        missing = int((fixed_ci[~empty] == -1).sum())
+        np.add.at(supplies, self.num_students + fixed_ci[empty], 1)
+        self.fixed_counts = np.bincount(
+            fixed_ci[fixed_ci >= 0], minlength=self.num_courses)
+        forced = ~empty & (fixed_ci != -1)
+        forced_si, forced_ci = fixed_si[forced], fixed_ci[forced]
+        # must include weight from incoming edge to student node
+        self.assign_costs = np.zeros(self.num_students, dtype=np.int64)
+        self.assign_costs[forced_si] = to_costs(
+            np.asarray(student_weights)[forced_si])
+        forced_edges = match_weights.find(forced_si, forced_ci)
+        if (forced_edges < 0).any():
+            raise ValueError('Fixed matches must be admissible pairs')
+        tails.append(forced_si)
+        heads.append(self.num_students + forced_ci)
+        costs.append(
+            -to_costs(match_weights.values[forced_edges]) -
+            self.assign_costs[forced_si])
+        supplies[forced_si] = 1
 
         # Edge weights given by preferences
-        for si in range(self.num_students):
-            if si not in fixed_matches["Student index"].values:
-                for ci in range(self.num_courses):
-                    if not np.isnan(match_weights[si, ci]):
-                        cost = -int(match_weights[si, ci] * 10 ** DIGITS)
-                        self.flow.AddArcWithCapacityAndUnitCost(
-                            si, self.num_students + ci, 1, cost)
+        is_fixed = np.zeros(self.num_students, dtype=bool)
+        is_fixed[fixed_si[~empty]] = True
+        pref_edges = np.flatnonzero(~is_fixed[match_weights.students])
+        tails.append(match_weights.students[pref_edges])
+        heads.append(self.num_students + match_weights.courses[pref_edges])
+        costs.append(-to_costs(match_weights.values[pref_edges]))
 
         # Attempt to fill max number of slots
-        self.flow.SetNodeSupply(
-            source, int(
-                min(self.num_students, self.slots) - len(
-                    fixed_matches.index) + missing))
-        self.flow.SetNodeSupply(sink, -int(min(self.num_students, self.slots)))
+        self.max_matches = int(min(self.num_students, self.slots))
+        supplies[source] = self.max_matches - len(
+            fixed_matches.index) + missing
+        supplies[sink] = -self.max_matches
 
         # Option for not maximizing number of matches
-        self.flow.AddArcWithCapacityAndUnitCost(
-            source, sink, int(
-                min(
-                    self.num_students, self.slots)), 0)
+        tails.append([source])
+        heads.append([sink])
+        costs.append([0])
+
+        self.tails = np.concatenate(tails).astype(np.int32)
+        self.heads = np.concatenate(heads).astype(np.int32)
+        self.costs = np.concatenate(costs).astype(np.int64)
+        self.capacities = np.ones(len(self.tails), dtype=np.int64)
+        self.capacities[-1] = self.max_matches
+        self.supplies = supplies
+
+        # arc index of the student -> course arc of every admissible pair of
+        # `match_weights`, or -1 if there is none
+        first_match_arc = self._slot_arcs_range[1]
+        self.pairs = match_weights
+        self.pair_arcs = np.full(len(match_weights), -1, dtype=np.int64)
+        self.pair_arcs[pref_edges] = first_match_arc + len(
+            forced_si) + np.arange(len(pref_edges))
+        self.pair_arcs[forced_edges] = first_match_arc + np.arange(
+            len(forced_si))
+
+    def _set_terminals(self):
+        slot_nodes = 0 if self.compact else self.slots
+        self.source, self.sink = range(
+            self.num_students + self.num_courses + slot_nodes,
+            2 + self.num_students + self.num_courses + slot_nodes)
 
-    def solve(self):
-        return self.flow.Solve() == self.flow.OPTIMAL
+    def _slot_arcs(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Returns the (tails, heads, costs) of the arcs into the sink """
+        slot_counts = np.maximum(self.slot_counts, 0)
+        total = int(slot_counts.sum())
+        slot_courses = np.repeat(np.arange(self.num_courses), slot_counts)
+        slot_indices = np.arange(total) - np.repeat(
+            np.cumsum(slot_counts) - slot_counts, slot_counts)
+        fill_values = to_costs(
+            self.base_fill[slot_courses] +
+            self.first_fill[slot_courses] / (slot_indices + 1))
+        if self.compact:
+            # parallel course -> sink arcs with decreasing fill values
+            return (self.num_students + slot_courses,
+                    np.full(total, self.sink), -fill_values)
+        # course -> slot and slot -> sink arcs are interleaved per slot
+        slot_nodes = self.num_students + self.num_courses + np.arange(total)
+        return (np.stack(
+            [self.num_students + slot_courses, slot_nodes], 1).ravel(),
+                np.stack([slot_nodes, np.full(total, self.sink)], 1).ravel(),
+                np.stack([-fill_values, np.zeros(total, dtype=np.int64)],
+                         1).ravel())
 
-    def get_matching(self, fixed_matches: pd.DataFrame, weights: np.ndarray) -> \
+    def slot_paths(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the course of every slot and the arcs from the course node to
+        the sink through the slot, one row per slot
+        """
+        slot_counts = np.maximum(self.slot_counts, 0)
+        slot_courses = np.repeat(np.arange(self.num_courses), slot_counts)
+        start, end = self._slot_arcs_range
+        return slot_courses, np.arange(start, end).reshape(
+            len(slot_courses), 1 if self.compact else 2)
+
+    def set_arc_costs(self, arcs, costs):
+        self.costs[arcs] = costs
+
+    def set_arc_capacities(self, arcs, capacities):
+        self.capacities[arcs] = capacities
+
+    def set_node_supplies(self, nodes, supplies):
+        self.supplies[nodes] = supplies
+
+    def match_arcs(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Returns the (students, courses, arcs) of the student -> course
+        arcs, sorted by student and then by course """
+        edges = np.flatnonzero(self.pair_arcs >= 0)
+        return (self.pairs.students[edges], self.pairs.courses[edges],
+                self.pair_arcs[edges])
+
+    def student_arcs(self, si: int) -> np.ndarray:
+        """ Returns the student -> course arcs of the student """
+        arcs = self.pair_arcs[self.pairs.student_edges(si)]
+        return arcs[arcs >= 0]
+
+    def update_match_weights(self, match_weights: EdgeWeights, students=None,
+                             courses=None):
+        """
+        Recomputes the costs of the student -> course arcs from
+        `match_weights`, either for every arc or only for the (`students`,
+        `courses`) pairs. Pairs without an arc are ignored, so the admissible
+        pairs stay those the graph was built with.
+        """
+        if students is None:
+            edges = np.flatnonzero(self.pair_arcs >= 0)
+            students = self.pairs.students[edges]
+            if match_weights.students is self.pairs.students:
+                # same pairs, so the weights line up with the edges
+                values = match_weights.values[edges]
+            else:
+                values = match_weights[students, self.pairs.courses[edges]]
+        else:
+            edges = self.pairs.find(students, courses)
+            students = np.asarray(students, dtype=int)[edges >= 0]
+            values = match_weights[
+                students, np.asarray(courses, dtype=int)[edges >= 0]]
+            edges = edges[edges >= 0]
+        arcs = self.pair_arcs[edges]
+        has_arc = arcs >= 0
+        self.set_arc_costs(
+            arcs[has_arc], -to_costs(values[has_arc]) -
+            self.assign_costs[students[has_arc]])
+
+    def batch_costs(self, match_values: np.ndarray) -> np.ndarray:
+        """
+        Costs of every arc for each row of `match_values`, which are weights
+        of the pairs the graph was built with (the costs that
+        `update_match_weights` would set)
+        """
+        edges = np.flatnonzero(self.pair_arcs >= 0)
+        costs = np.repeat(self.costs[np.newaxis], len(match_values), axis=0)
+        costs[:, self.pair_arcs[edges]] = -to_costs(
+            match_values[:, edges]) - self.assign_costs[
+            self.pairs.students[edges]]
+        return costs
+
+    def fill_slot(self, ci: int):
+        """ Fills one slot of the course without a student, like a fixed match
+        with student index -1 """
+        self.fixed_counts[ci] += 1
+        if self.fixed_counts[ci] > self.slot_counts[ci]:
+            self.set_course_slots(ci, self.fixed_counts[ci])
+        self.set_node_supplies(
+            [self.source, self.num_students + ci],
+            [self.supplies[self.source] - 1,
+             self.supplies[self.num_students + ci] + 1])
+
+    def remove_student(self, si: int):
+        """ Removes the student's course arcs, like a fixed match with course
+        index -1 """
+        self.set_arc_capacities(self.student_arcs(si), 0)
+
+    def set_course_slots(self, ci: int, slots: int):
+        """ Changes the number of slots of the course, which changes the nodes
+        and arcs of the graph """
+        if self.fixed_counts[ci] > 0:
+            slots = max(slots, self.fixed_counts[ci])
+        old_source, old_sink = self.source, self.sink
+        old_max_matches = self.max_matches
+        self.slot_counts[ci] = slots
+        self.slots = int(self.slot_counts.sum())
+        self.max_matches = int(min(self.num_students, self.slots))
+        self._set_terminals()
+
+        for nodes in (self.tails, self.heads):
+            is_source, is_sink = nodes == old_source, nodes == old_sink
+            nodes[is_source] = self.source
+            nodes[is_sink] = self.sink
+        supplies = np.zeros(self.sink + 1, dtype=np.int64)
+        supplies[:self.num_students + self.num_courses] = self.supplies[
+            :self.num_students + self.num_courses]
+        supplies[self.source] = self.supplies[
+            old_source] + self.max_matches - old_max_matches
+        supplies[self.sink] = -self.max_matches
+        self.supplies = supplies
+
+        start, end = self._slot_arcs_range
+        slot_tails, slot_heads, slot_costs = self._slot_arcs()
+        self.tails = np.concatenate(
+            [self.tails[:start], slot_tails, self.tails[end:]]).astype(
+            np.int32)
+        self.heads = np.concatenate(
+            [self.heads[:start], slot_heads, self.heads[end:]]).astype(
+            np.int32)
+        self.costs = np.concatenate(
+            [self.costs[:start], slot_costs, self.costs[end:]])
+        self.capacities = np.concatenate(
+            [self.capacities[:start], np.ones(len(slot_tails), dtype=np.int64),
+             self.capacities[end:]])
+        self.capacities[-1] = self.max_matches
+        self._slot_arcs_range = (start, start + len(slot_tails))
+        self.pair_arcs = np.where(
+            self.pair_arcs >= 0,
+            self.pair_arcs + start + len(slot_tails) - end, -1)
+
+    def checkpoint(self) -> dict:
+        """ Returns the current state of the graph, see `restore` """
+        return {name: copy.copy(value) for name, value in self.__dict__.items()
+                if name != 'solver'}
+
+    def restore(self, state: dict):
+        """ Undoes every edit made after `checkpoint` returned `state` """
+        self.__dict__.update(
+            {name: copy.copy(value) for name, value in state.items()})
+
+    def fingerprint(self) -> bytes:
+        """
+        Digest of the problem the graph currently poses to its solver: the
+        backend and every arc and node. Edits that end up with the same
+        costs, capacities and supplies have the same fingerprint.
+        """
+        digest = hashlib.blake2b(type(self.solver).__name__.encode())
+        for array in (self.tails, self.heads, self.capacities, self.costs,
+                      self.supplies):
+            digest.update(len(array).to_bytes(8, 'little'))
+            digest.update(np.ascontiguousarray(array, dtype=np.int64))
+        return digest.digest()
+
+    def solve(self, cached=True):
+        """
+        Solves the graph, through `solve_cache` unless not `cached` (for
+        graphs that will not be solved again, such as noisy trials)
+        """
+        if cached and solve_cache.max_size > 0:
+            key = self.fingerprint()
+            solved, self.flows = solve_cache.lookup(key)
+            if not solved:
+                self.flows = self.solver.solve(self)
+                solve_cache.store(key, self.flows)
+        else:
+            self.flows = self.solver.solve(self)
+        if self.flows is None:
+            return False
+        self.optimal_cost = int(self.costs @ self.flows)
+        return True
+
+    def arc_flows(self) -> np.ndarray:
+        """ Flow on every arc. Requires that the graph has been solved """
+        return self.flows
+
+    def get_matching(self, fixed_matches: pd.DataFrame,
+                     weights: EdgeWeights,
+                     flows: Optional[np.ndarray] = None) -> \
             List[Tuple[int, int]]:
-        """Returns list of (si, ci) matches"""
-        matches = []
-        fixed_matches = fixed_matches[['Student index', 'Course index']]
-        for arc in range(self.flow.NumArcs()):
-            si = self.flow.Tail(arc)
-            ci = self.flow.Head(arc) - self.num_students
-            # arcs from student to course
-            if self.flow.Flow(arc) > 0 and si < self.num_students:
-                matches.append((si, ci))
-            # arcs from source to student
-            elif ci < 0 and self.flow.Flow(arc) == 0:
-                rows = fixed_matches.loc[
-                    fixed_matches['Student index'] == self.flow.Head(arc)]
-                if len(rows.index) == 0 or rows.iloc[0]['Course index'] == -1:
-                    matches.append((self.flow.Head(arc), -1))
+        """
+        Returns list of (si, ci) matches of `flows`, by default the flows
+        of the last solve
+        """
+        if flows is None:
+            flows = self.flows
+        fixed_si = fixed_matches['Student index'].to_numpy(dtype=int)
+        fixed_ci = fixed_matches['Course index'].to_numpy(dtype=int)
+        # course of the first fixed match of each student, if any
+        has_course = np.zeros(self.num_students, dtype=bool)
+        students, first = np.unique(fixed_si, return_index=True)
+        first = first[students >= 0]
+        has_course[fixed_si[first]] = fixed_ci[first] != -1
+
+        # arcs from student to course
+        is_match = (flows > 0) & (self.tails < self.num_students)
+        # arcs from source to student
+        is_unassigned = (flows == 0) & (self.heads < self.num_students)
+        is_unassigned[is_unassigned] = ~has_course[
+            self.heads[is_unassigned]]
+        arcs = np.flatnonzero(is_match | is_unassigned)
+        si = np.where(is_match[arcs], self.tails[arcs], self.heads[arcs])
+        ci = np.where(
+            is_match[arcs], self.heads[arcs] - self.num_students, -1)
 
         # put fixed matches at top and unassigned at bottom
-        matches.sort(
-            key=lambda tup: 100 if tup[1] == -1 else (
-                -100 if (fixed_matches == tup).all(1).any() else -weights[
-                    tup[0], tup[1]]))
-        return matches
+        num_codes = self.num_courses + 1
+        is_fixed = np.isin(si * num_codes + ci + 1,
+                           fixed_si * num_codes + fixed_ci + 1)
+        keys = np.where(ci == -1, 100.0, np.where(
+            is_fixed, -100.0, -weights[si, np.maximum(ci, 0)]))
+        order = np.argsort(keys, kind='stable')
+        return list(zip(si[order].tolist(), ci[order].tolist()))
 
     def get_slots_filled(self, matches: List[Tuple[int, int]]) -> List[int]:
         slots_filled = [0] * self.num_courses
@@ -133,7 +479,7 @@ class MatchingGraph:
     def get_slots_unfilled(self, slots_filled: List[int]) -> int:
         return self.slots - sum(slots_filled)
 
-    def write_matching(self, filename: str, weights: np.ndarray,
+    def write_matching(self, filename: str, weights: EdgeWeights,
                        student_data: pd.DataFrame, course_data: pd.DataFrame,
                        fixed_matches: pd.DataFrame) -> Tuple[
             float, int, List[Tuple[int, int]]]:
@@ -167,8 +513,8 @@ class MatchingGraph:
                 if ci >= 0:
                     course = course_data.index[ci]
                     slots = course_data.loc[course, "Slots"]
-                    s_rank = student_data.loc[student, course]
-                    c_rank = course_data.loc[course, student]
+                    s_rank = student_data.ranks.rank(student, course)
+                    c_rank = course_data.ranks.rank(course, student)
                     is_previous = course in student_data.loc[
                         student, "Previous"].split(';')
                     for instructor in course_data.loc[
@@ -196,12 +542,12 @@ class MatchingGraph:
 
     def graph_weight(self):
         """ Requires that the graph has been solved before """
-        return -self.flow.OptimalCost() / (10 ** DIGITS)
+        return -self.optimal_cost / (10 ** DIGITS)
 
     def print(self):
-        for arc in range(self.flow.NumArcs()):
+        for arc in np.flatnonzero(self.capacities > 0):
             print(
                 "start: {}, end: {}, capacity: {}, cost: {}, flow:{}".format(
-                    self.flow.Tail(arc), self.flow.Head(arc),
-                    self.flow.Capacity(arc), self.flow.UnitCost(arc),
-                    self.flow.Flow(arc)))
+                    self.tails[arc], self.heads[arc], self.capacities[arc],
+                    self.costs[arc],
+                    None if self.flows is None else self.flows[arc]))
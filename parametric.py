@@ -0,0 +1,71 @@
+from fractions import Fraction
+from typing import Optional, Tuple
+
+import numpy as np
+
+import min_cost_flow
+
+# a solution of the graph: its flows, its cost without discount and the
+# number of discounted arcs it uses, so its cost is linear in the discount
+Line = Tuple[np.ndarray, int, int]
+
+COST_UNIT = 10 ** min_cost_flow.DIGITS
+
+
+def line_cost(line: Line, discount: Fraction) -> Fraction:
+    """ Cost of the solution when the discounted arcs are discounted """
+    return line[1] + COST_UNIT * discount * line[2]
+
+
+def solve_discounted(graph: min_cost_flow.MatchingGraph,
+                     base_costs: np.ndarray, arcs: np.ndarray,
+                     discount: Fraction) -> Optional[Line]:
+    """
+    Solves `graph` with the weight of `arcs` lowered by `discount` (so their
+    costs raised by `discount` * `COST_UNIT`) and restores its costs. The
+    costs are scaled by the denominator of `discount`, so the solve is exact.
+    Of the optimal solutions, returns the one using the fewest of `arcs`,
+    which is the one that stays optimal for slightly larger discounts.
+    """
+    state = graph.checkpoint()
+    is_discounted = np.zeros(len(base_costs), dtype=np.int64)
+    is_discounted[arcs] = 1
+    # ties are broken by the number of discounted arcs used
+    ties = len(arcs) + 1
+    graph.set_arc_costs(
+        np.arange(len(base_costs)),
+        (base_costs * discount.denominator +
+         COST_UNIT * discount.numerator * is_discounted) * ties +
+        is_discounted)
+    solved = graph.solve()
+    flows = graph.arc_flows()
+    graph.restore(state)
+    if not solved:
+        return None
+    return flows, int(base_costs @ flows), int(flows[arcs].sum())
+
+
+def next_breakpoint(graph: min_cost_flow.MatchingGraph,
+                    base_costs: np.ndarray, arcs: np.ndarray,
+                    discount: Fraction, current: Line) -> Optional[
+        Tuple[Fraction, Line]]:
+    """
+    Returns the smallest discount of `arcs` above `discount` at which
+    `current`, optimal just above `discount`, stops being optimal, and the
+    solution that is optimal just above that discount. This is the minimum
+    ratio of the cost of a cycle in the residual graph of `current` to the
+    number of discounted arcs it takes out, found by Newton (Dinkelbach)
+    iterations from a discount at which any solution using fewer of `arcs`
+    is better. Returns `None` if no discount changes the optimum.
+    """
+    bound = Fraction(1 + int(np.abs(base_costs).sum()), COST_UNIT)
+    other = solve_discounted(graph, base_costs, arcs, discount + bound)
+    while other is not None and other[2] < current[2]:
+        # discount at which both solutions cost the same
+        crossing = Fraction(other[1] - current[1],
+                            COST_UNIT * (current[2] - other[2]))
+        best = solve_discounted(graph, base_costs, arcs, crossing)
+        if line_cost(best, crossing) == line_cost(current, crossing):
+            return crossing, best
+        other = best
+    return None
@@ -0,0 +1,103 @@
+from typing import Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# rank names by code, code 0 means there is no rank
+RANK_NAMES = ['', 'Okay', 'Good', 'Favorite', 'Veto']
+rank_codes = {name: code for code, name in enumerate(RANK_NAMES) if name}
+
+
+class Ranks:
+    """
+    Ranks that the rows of one input table give to the IDs of the other
+    (students rank courses and instructors rank students), kept as columns:
+    the row, the interned ID it ranks, the rank code and the sorted place of
+    every rank. If a row ranks an ID more than once, the last rank counts.
+    """
+
+    def __init__(self, row_ids: pd.Index, ids: pd.Index, rows: np.ndarray,
+                 others: np.ndarray, codes: np.ndarray, places: np.ndarray):
+        self.row_ids = row_ids
+        self.ids = ids
+        self.rows, self.others = rows, others
+        self.codes, self.places = codes, places
+        self._lookup = dict(zip(
+            zip(row_ids[rows].tolist(), ids[others].tolist()),
+            zip(codes.tolist(), places.tolist())))
+
+    @classmethod
+    def from_lists(cls, row_ids: pd.Index, rows, ids, names, places) -> 'Ranks':
+        """
+        Ranks from one entry per rank: the row position, the ranked ID, the
+        rank name and the sorted place
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        unique_ids = pd.Index(pd.unique(np.asarray(ids, dtype=object)))
+        others = unique_ids.get_indexer(np.asarray(ids, dtype=object))
+        codes = np.array([rank_codes[name] for name in names], dtype=np.int8)
+        places = np.asarray(places, dtype=np.int64)
+        # keep the last rank of every (row, ID)
+        keys = rows * len(unique_ids) + others
+        _, last = np.unique(keys[::-1], return_index=True)
+        last = np.sort(len(keys) - 1 - last)
+        return cls(row_ids, unique_ids, rows[last], others[last], codes[last],
+                   places[last])
+
+    def matrices(self, other_ids: pd.Index) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the rank code and the sorted place that every row gives to
+        every ID of `other_ids`, with code 0 where there is no rank
+        """
+        shape = (len(self.row_ids), len(other_ids))
+        codes = np.zeros(shape, dtype=np.int8)
+        places = np.zeros(shape, dtype=np.int64)
+        cols = other_ids.get_indexer(self.ids)[self.others]
+        known = cols >= 0
+        codes[self.rows[known], cols[known]] = self.codes[known]
+        places[self.rows[known], cols[known]] = self.places[known]
+        return codes, places
+
+    def rank(self, row_id: str, other_id: str) -> Union[Tuple[str, int], float]:
+        """ (rank, place) that the row gives to the ID, or NaN """
+        code_place = self._lookup.get((row_id, other_id))
+        if code_place is None:
+            return np.nan
+        return RANK_NAMES[code_place[0]], code_place[1]
+
+    def wide(self) -> pd.DataFrame:
+        """ One object column of (rank, place) tuples per ranked ID """
+        cells = np.full((len(self.row_ids), len(self.ids)), np.nan,
+                        dtype=object)
+        for row, other, code, place in zip(
+                self.rows.tolist(), self.others.tolist(),
+                self.codes.tolist(), self.places.tolist()):
+            cells[row, other] = (RANK_NAMES[code], place)
+        return pd.DataFrame(cells, index=self.row_ids, columns=self.ids)
+
+
+class RankedFrame(pd.DataFrame):
+    """
+    Scalar columns of the students or courses, one row per ID, which keeps
+    the ranks the rows give to the other table as `ranks`. Frames derived
+    from it keep the same `ranks`.
+    """
+    _metadata = ['ranks']
+
+    @property
+    def _constructor(self):
+        return RankedFrame
+
+    def wide(self, other_ids: pd.Index = None) -> pd.DataFrame:
+        """
+        The frame with one column of (rank, place) tuples per ranked ID, and
+        a NaN column for each of `other_ids` that is not ranked, as the
+        loaders returned before the ranks were kept as columns
+        """
+        frame = pd.concat([pd.DataFrame(self), self.ranks.wide()],
+                          axis='columns')
+        if other_ids is not None:
+            missing = other_ids[~other_ids.isin(frame.columns)]
+            frame = pd.concat([frame, pd.DataFrame(
+                np.nan, index=frame.index, columns=missing)], axis='columns')
+        return frame
@@ -0,0 +1,218 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import dijkstra
+
+import min_cost_flow
+
+# (matches, graph weight) of a changed graph
+NewMatching = Optional[Tuple[List[Tuple[int, int]], float]]
+
+
+class ResidualGraph:
+    """
+    Residual graph of a solved `MatchingGraph`. Changing the supplies of the
+    graph by one unit changes its optimal flow by a single shortest path in the
+    residual graph, so the additional TA and removing TA analyses can be
+    answered with a few shortest path searches instead of a solve per
+    scenario.
+
+    Residual arcs are searched with their reduced costs, which are
+    non-negative under the node potentials of the optimal flow.
+    """
+
+    def __init__(self, graph: min_cost_flow.MatchingGraph):
+        self.graph = graph
+        self.flows = graph.arc_flows()
+        self.cost = graph.optimal_cost
+        self.num_nodes = len(graph.supplies)
+
+        arcs = np.arange(len(graph.tails))
+        forward = self.flows < graph.capacities
+        backward = self.flows > 0
+        # residual arc i undoes (direction -1) or adds (direction 1) flow on
+        # `self.arcs[i]`
+        self.arcs = np.concatenate([arcs[forward], arcs[backward]])
+        self.directions = np.concatenate(
+            [np.ones(forward.sum(), dtype=int),
+             -np.ones(backward.sum(), dtype=int)])
+        self.tails = np.concatenate(
+            [graph.tails[forward], graph.heads[backward]])
+        self.heads = np.concatenate(
+            [graph.heads[forward], graph.tails[backward]])
+        self.costs = graph.costs[self.arcs] * self.directions
+
+        self.potentials = self._potentials()
+        reduced = self.costs + self.potentials[self.tails] - self.potentials[
+            self.heads]
+        # only the cheapest of parallel residual arcs can be on a shortest path
+        order = np.lexsort((reduced, self.heads, self.tails))
+        pairs = self.tails[order].astype(
+            np.int64) * self.num_nodes + self.heads[order]
+        cheapest = order[np.concatenate([[True], pairs[1:] != pairs[:-1]])]
+        # among paths of equal cost, prefer those through lower-indexed arcs
+        # (the fractions of a path add up to less than one unit of cost)
+        tie_break = self.arcs[cheapest] / (
+                len(graph.tails) * float(self.num_nodes))
+        self.reduced_graph = sp.csr_matrix(
+            (reduced[cheapest].astype(np.float64) + tie_break,
+             (self.tails[cheapest], self.heads[cheapest])),
+            shape=(self.num_nodes, self.num_nodes))
+        self.arc_lookup = sp.csr_matrix(
+            (cheapest + 1, (self.tails[cheapest], self.heads[cheapest])),
+            shape=(self.num_nodes, self.num_nodes))
+
+    def _potentials(self) -> np.ndarray:
+        """
+        Shortest distances from a virtual node with a zero cost arc to every
+        node (Bellman-Ford), which exist because an optimal flow leaves no
+        negative cycle in the residual graph
+        """
+        distances = np.zeros(self.num_nodes, dtype=np.int64)
+        for _ in range(self.num_nodes):
+            relaxed = distances.copy()
+            np.minimum.at(
+                relaxed, self.heads, distances[self.tails] + self.costs)
+            if np.array_equal(relaxed, distances):
+                break
+            distances = relaxed
+        return distances
+
+    def _shortest_paths(self, starts: List[int]) -> Tuple[
+            np.ndarray, np.ndarray]:
+        """ Returns the true distances and the predecessors from `starts` """
+        reduced, predecessors = dijkstra(
+            self.reduced_graph, indices=starts, return_predecessors=True)
+        # drop the tie break fractions and undo the potentials
+        distances = np.floor(reduced) + self.potentials[np.newaxis, :] - \
+            self.potentials[np.asarray(starts)][:, np.newaxis]
+        return distances, predecessors
+
+    def _push(self, flows: np.ndarray, predecessors: np.ndarray, start: int,
+              end: int):
+        """ Sends one unit along the shortest path from `start` to `end` """
+        node = end
+        while node != start:
+            previous = predecessors[node]
+            residual = self.arc_lookup[previous, node] - 1
+            flows[self.arcs[residual]] += self.directions[residual]
+            node = previous
+
+    def _matching(self, flows: np.ndarray) -> List[Tuple[int, int]]:
+        """ (si, ci) matches of `flows`, in no particular order """
+        graph = self.graph
+        students, courses, arcs = graph.match_arcs()
+        matched = flows[arcs] > 0
+        matches = list(zip(students[matched].tolist(),
+                           courses[matched].tolist()))
+        # students without flow from the source that are not fixed to a course
+        has_course = np.zeros(graph.num_students, dtype=bool)
+        has_course[students[matched]] = True
+        unassigned = np.flatnonzero(
+            (flows[:graph.num_students] == 0) & ~has_course)
+        return matches + [(si, -1) for si in unassigned.tolist()]
+
+    def _weight(self, cost: int) -> float:
+        return -cost / (10 ** min_cost_flow.DIGITS)
+
+    def fill_slot(self, courses: List[int]) -> Dict[int, NewMatching]:
+        """
+        Optimal matching after filling one slot of each course without a
+        student (see `MatchingGraph.fill_slot`), which sends one unit less
+        from the source and one more from the course node
+        """
+        if not courses:
+            return {}
+        starts = [self.graph.num_students + ci for ci in courses]
+        distances, predecessors = self._shortest_paths(starts)
+        results = {}
+        for i, ci in enumerate(courses):
+            distance = distances[i, self.graph.source]
+            if not np.isfinite(distance):
+                results[ci] = None
+                continue
+            flows = self.flows.copy()
+            self._push(flows, predecessors[i], starts[i], self.graph.source)
+            results[ci] = self._matching(flows), self._weight(
+                self.cost + int(distance))
+        return results
+
+    def remove_student(self, students: List[int]) -> Dict[int, NewMatching]:
+        """
+        Optimal matching after removing each matched, non-fixed student (see
+        `MatchingGraph.remove_student`): the student's unit is sent back to
+        the source and the source reaches the student's course another way
+        """
+        graph = self.graph
+        distances, predecessors = self._shortest_paths([graph.source])
+        results = {}
+        for si in students:
+            arcs = graph.student_arcs(si)
+            arcs = arcs[self.flows[arcs] > 0]
+            if len(arcs) == 0:
+                # an unmatched student is not missed
+                results[si] = self._matching(self.flows), self._weight(
+                    self.cost)
+                continue
+            arc = arcs[0]
+            course_node = graph.heads[arc]
+            distance = distances[0, course_node]
+            if not np.isfinite(distance):
+                results[si] = None
+                continue
+            flows = self.flows.copy()
+            flows[[si, arc]] -= 1
+            self._push(flows, predecessors[0], graph.source, course_node)
+            results[si] = self._matching(flows), self._weight(
+                self.cost - graph.costs[si] - graph.costs[arc] + int(
+                    distance))
+        return results
+
+    def forced_costs(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        For each (student, course) pair of the graph, the smallest increase
+        of the optimal cost when its arc must carry flow (0 if it does), and
+        the number of student -> course arcs on the cycle in the residual
+        graph that does it: the arc and the shortest path back from the
+        course to the student. The cost is infinite if no cycle exists, and
+        NaN for pairs without an arc.
+        """
+        graph = self.graph
+        num_students = graph.num_students
+        course_nodes = num_students + np.arange(graph.num_courses)
+        distances, predecessors = self._shortest_paths(course_nodes.tolist())
+
+        # student -> course arcs on the path from each course to each node,
+        # counted down the shortest path trees
+        reachable = predecessors >= 0
+        previous = np.where(reachable, predecessors, 0)
+        nodes = np.broadcast_to(np.arange(self.num_nodes), previous.shape)
+        is_course = (nodes >= num_students) & (
+                nodes < num_students + graph.num_courses)
+        previous_is_course = (previous >= num_students) & (
+                previous < num_students + graph.num_courses)
+        steps = reachable & (((nodes < num_students) & previous_is_course) | (
+                (previous < num_students) & is_course))
+        rows = np.arange(len(course_nodes))[:, np.newaxis]
+        hops = steps.astype(np.int64)
+        for _ in range(self.num_nodes):
+            deeper = steps + np.where(reachable, hops[rows, previous], 0)
+            if np.array_equal(deeper, hops):
+                break
+            hops = deeper
+
+        students, courses, arcs = graph.match_arcs()
+        arc_costs = (graph.costs[arcs] +
+                     distances[courses, students]).astype(np.float64)
+        arc_costs[graph.capacities[arcs] == 0] = np.inf
+        arc_costs[self.flows[arcs] > 0] = 0.0
+        arc_hops = 1 + hops[courses, students]
+        arc_hops[self.flows[arcs] > 0] = 1
+
+        edges = np.flatnonzero(graph.pair_arcs >= 0)
+        costs = np.full(len(graph.pairs), np.nan)
+        costs[edges] = arc_costs
+        cycle_arcs = np.ones(len(graph.pairs), dtype=np.int64)
+        cycle_arcs[edges] = arc_hops
+        return costs, cycle_arcs
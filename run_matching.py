@@ -17,7 +17,9 @@ def preprocess_input_run_matching_and_write_matching(executor='UNCERTAIN',
                                                      student_preferences_sheet_id: str = None,
                                                      instructor_preferences_sheet_id: str = None,
                                                      compare_matching_from_num_executed: str = None,
-                                                     skip_previous=False):
+                                                     skip_previous=False,
+                                                     backend='ortools',
+                                                     jobs=1):
     num_executed, matchings_sheet, matchings_worksheets, planning_input_copy_worksheets = write_gs.get_num_execution_from_matchings_sheet()
     if skip_previous:
         compare_matching_from_num_executed = None
@@ -39,7 +41,8 @@ def preprocess_input_run_matching_and_write_matching(executor='UNCERTAIN',
         executor, input_dir_title, matchings_worksheets,
         include_remove_and_add_features, include_interviews, num_executed,
         num_executed, matchings_sheet, planning_input_copy_worksheets,
-        compare_matching_from_num_executed, alternates, input_copy_ids)
+        compare_matching_from_num_executed, alternates, input_copy_ids,
+        backend, jobs)
 
 
 def run_and_write_matchings(executor: str, input_dir_title: str,
@@ -54,12 +57,13 @@ def run_and_write_matchings(executor: str, input_dir_title: str,
                                 write_gs.Worksheet] = None,
                             compare_matching_from_num_executed: str = None,
                             alternates=0,
-                            input_copy_ids: write_gs.InputCopyIDs = None):
+                            input_copy_ids: write_gs.InputCopyIDs = None,
+                            backend='ortools', jobs=1):
     """
     if `input_num_executed` is `None`, then use most recent copy
     """
     matching_weight, slots_unfilled, alt_weights, output_dir_path = run_matching(
-        input_dir_title, alternates, include_interviews)
+        input_dir_title, alternates, include_interviews, backend, jobs)
     write_matchings(
         executor, output_dir_path, matching_weight, matchings_worksheets,
         matchings_sheet, planning_worksheets, include_remove_and_add_features,
@@ -68,12 +72,13 @@ def run_and_write_matchings(executor: str, input_dir_title: str,
         input_copy_ids)
 
 
-def run_matching(input_dir_title: str, alternates=0, run_interviews=False) -> \
-        Tuple[float, int, List[float], str]:
+def run_matching(input_dir_title: str, alternates=0, run_interviews=False,
+                 backend='ortools',
+                 jobs=1) -> Tuple[float, int, List[float], str]:
     output_dir_path = f"data/{input_dir_title}"
     matching_weight, slots_unfilled, alt_weights = matching.run_matching(
         path=output_dir_path, alternates=alternates,
-        run_interviews=run_interviews)
+        run_interviews=run_interviews, backend=backend, jobs=jobs)
     if slots_unfilled > 0:
         print(f"\tunfilled slots: {slots_unfilled}")
     return matching_weight, slots_unfilled, alt_weights, output_dir_path
@@ -173,6 +178,13 @@ if __name__ == "__main__":
     parser.add_argument(
         '--fac_prefs', required=False, type=str,
         help='The Google Sheets id for the instructor preferences sheet')
+    parser.add_argument(
+        '--backend', default='ortools',
+        choices=sorted(matching.min_cost_flow.flow_solvers.SOLVERS),
+        help='Solver of the matching graph')
+    parser.add_argument(
+        '--jobs', default=1, type=int,
+        help='Number of processes solving the what-if scenarios')
 
     args = parser.parse_args()
     if args.planning and args.ta_prefs and args.fac_prefs:
@@ -180,11 +192,13 @@ if __name__ == "__main__":
         preprocess_input_run_matching_and_write_matching(
             args.name, args.input_path, not args.exclude_add_remove,
             args.run_interviews, args.alternates, args.planning, args.ta_prefs,
-            args.fac_prefs, args.compare_to, args.skip_prvious)
+            args.fac_prefs, args.compare_to, args.skip_prvious, args.backend,
+            args.jobs)
     else:
         print("Running and writing")
         run_and_write_matchings(
             args.name, args.input_path,
             include_remove_and_add_features=not args.exclude_add_remove,
             include_interviews=args.run_interviews, alternates=args.alternates,
-            compare_matching_from_num_executed=args.compare_to)
+            compare_matching_from_num_executed=args.compare_to,
+            backend=args.backend, jobs=args.jobs)
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, Optional
+
+import numpy as np
+
+# change when the stored counts are computed differently
+STORE_VERSION = 1
+
+
+class TrialStore:
+    """
+    Counts of interview trials kept in `store_dir`, under the key of the
+    instance (see `instance_cache.instance_key`), so an interrupted run can
+    be resumed and a later run with the same inputs reuses the trials instead
+    of running them again. Each run of trials is one .npz file, keyed by the
+    seed, the options that change the counts, sigma and its trial numbers.
+    """
+
+    def __init__(self, store_dir: str, instance_key: str):
+        self.directory = os.path.join(store_dir, instance_key)
+        self.run_directory = None
+
+    def entropy(self, seed: Optional[int]) -> int:
+        """
+        Entropy of the noise for `seed`. Without a seed, the entropy drawn
+        by the first unseeded run of the instance is kept and reused, so
+        unseeded runs can be resumed too.
+        """
+        if seed is not None:
+            return np.random.SeedSequence(seed).entropy
+        filename = os.path.join(self.directory, 'unseeded.json')
+        if os.path.isfile(filename):
+            with open(filename) as f:
+                return json.load(f)['entropy']
+        entropy = np.random.SeedSequence().entropy
+        self._write(filename, lambda f: json.dump({'entropy': entropy}, f),
+                    'w')
+        return entropy
+
+    def open_run(self, entropy: int, options: dict):
+        """ Keeps the counts of trials drawn from `entropy` with `options` """
+        key = json.dumps({'version': STORE_VERSION, 'entropy': entropy,
+                          'options': options}, sort_keys=True)
+        self.run_directory = os.path.join(
+            self.directory, hashlib.sha256(key.encode()).hexdigest())
+        os.makedirs(self.run_directory, exist_ok=True)
+
+    def load(self, sigma: float, trials: int, first_trial: int) -> Optional[
+            Dict[str, np.ndarray]]:
+        filename = self._filename(sigma, trials, first_trial)
+        if not os.path.isfile(filename):
+            return None
+        with np.load(filename, allow_pickle=False) as arrays:
+            return dict(arrays)
+
+    def save(self, sigma: float, trials: int, first_trial: int,
+             arrays: Dict[str, np.ndarray]):
+        self._write(self._filename(sigma, trials, first_trial),
+                    lambda f: np.savez(f, **arrays), 'wb')
+
+    def _filename(self, sigma: float, trials: int, first_trial: int) -> str:
+        name = f'{float(sigma).hex()}_{first_trial}_{trials}.npz'
+        return os.path.join(self.run_directory, name)
+
+    def _write(self, filename: str, write, mode: str):
+        # write to a temporary file first, so a partly written file is never
+        # read after an interruption
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        handle, partial = tempfile.mkstemp(dir=os.path.dirname(filename))
+        try:
+            with os.fdopen(handle, mode) as f:
+                write(f)
+            os.replace(partial, filename)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise